@@ -5,6 +5,7 @@ jupyderp - Convert Jupyter notebooks to fully accessible interactive HTML pages.
 Usage:
     # Convert a single notebook
     python jupyderp.py notebook.ipynb [-o output.html] [--title "Custom Title"]
+                                      [--precompress]
 
     # Launch the web interface
     python jupyderp.py --serve [--port 8000]
@@ -23,30 +24,118 @@ Produces a single self-contained HTML file with:
 
 import argparse
 import base64
+import binascii
+import hashlib
 import html
 import io
 import json
+import mmap
 import os
 import re as _re
+import shutil
 import sys
 import tempfile
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+from html.parser import HTMLParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
+from types import MappingProxyType
+from typing import Iterable, Iterator
+
+try:  # optional: much faster JSON serialization for image-heavy notebooks
+    import orjson
+except ImportError:
+    orjson = None
+
+try:  # optional: smaller --serve responses and --precompress .br files
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _loads(data: bytes | memoryview):
+    """Parse JSON bytes, preferring orjson when it is installed."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is stricter than the stdlib (e.g. NaN written by some
+            # kernels into metadata); let json decide or raise its own error
+            pass
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+# Notebooks larger than this are memory-mapped rather than read into a
+# bytes object first (only worth it when orjson can parse the mapping)
+_MMAP_THRESHOLD = 1 << 20
 
 
 def read_notebook(path: str) -> dict:
     """Read and parse a .ipynb notebook file."""
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    with open(path, "rb") as f:
+        if orjson is not None and os.fstat(f.fileno()).st_size > _MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                with memoryview(mm) as view:
+                    return _loads(view)
+        return _loads(f.read())
 
 
 def _join(lines) -> str:
     """Join a list-of-strings field (or return a string as-is)."""
-    if isinstance(lines, list):
+    # Exact type check: notebook JSON only yields plain lists, and this is
+    # called for nearly every field of every cell
+    if type(lines) is list:
         return "".join(lines)
     return lines or ""
 
 
+def _extend_lines(parts: list, lines) -> None:
+    """Add a list-of-strings field to *parts* without joining it first."""
+    if type(lines) is list:
+        parts.extend(lines)
+    elif lines:
+        parts.append(lines)
+
+
+_HTML_SPECIAL_RE = _re.compile(r"[&<>\"']")
+
+
+def _maybe_escape(text: str) -> str:
+    """html.escape, skipping its five replace passes when nothing needs it."""
+    return html.escape(text) if _HTML_SPECIAL_RE.search(text) else text
+
+
+# str.translate table for base64 payloads: deletes whitespace and maps any
+# other ASCII character outside the base64 alphabet to NUL
+_B64_CLEAN = str.maketrans({
+    i: None if chr(i) in " \t\n\r\f\v" else "\0"
+    for i in range(128)
+    if not (chr(i).isalnum() or chr(i) in "+/=")
+})
+
+
+def _collect_b64(img_data) -> str:
+    """Canonicalize a base64 image payload (no whitespace/newlines).
+
+    One C-level translate pass drops the line breaks Jupyter writes every
+    76 characters and flags foreign characters, so a payload that could
+    break out of the data: URL raises binascii.Error instead of being
+    embedded; the data itself is never decoded.
+    """
+    # Handle both string and list-of-strings
+    if isinstance(img_data, list):
+        img_data = "".join(img_data)
+    cleaned = img_data.translate(_B64_CLEAN)
+    if "\0" in cleaned or not cleaned.isascii():
+        raise binascii.Error("invalid character in base64 image data")
+    return cleaned
+
+
 _SAFE_TAGS = frozenset({
     "a", "abbr", "b", "blockquote", "br", "caption", "code", "col",
     "colgroup", "dd", "del", "details", "dfn", "div", "dl", "dt", "em",
@@ -76,60 +165,112 @@ _SAFE_ATTRS = frozenset({
     "viewBox", "x", "x1", "x2", "xmlns", "y", "y1", "y2",
 })
 _DANGEROUS_URL_SCHEMES = _re.compile(
-    r"^\s*(?:javascript|vbscript|data)\s*:", _re.IGNORECASE
+    r"^[\x00-\x20]*(?:javascript|vbscript|data)\s*:", _re.IGNORECASE
 )
+# Browsers drop these anywhere in a URL before parsing its scheme, so
+# "java\tscript:" must be checked as "javascript:"
+_URL_IGNORED_CHARS = str.maketrans("", "", "\t\n\r")
+# ANSI escape sequences (colours, OSC hyperlinks) found in tracebacks
+_ANSI_RE = _re.compile(r"\x1b\[[0-9;:]*[A-Za-z]|\x1b\][^\x07]*(?:\x07|\x1b\\)")
 
 
-def _sanitize_html(html_str: str) -> str:
-    """Allowlist-based HTML sanitizer: keeps only safe tags and attributes."""
-    def _replace_tag(m: _re.Match) -> str:
-        full = m.group(0)
-        tag_name = m.group(2).lower()
-        # Closing tag
-        if full.startswith("</"):
-            return full if tag_name in _SAFE_TAGS else ""
-        # Opening/self-closing tag
-        if tag_name not in _SAFE_TAGS:
-            return ""
-        # Filter attributes
-        attr_str = m.group(3) or ""
+class _SanitizingParser(HTMLParser):
+    """Re-emit parsed HTML, keeping only allowlisted tags and attributes.
+
+    The stdlib tokenizer reads the input in one linear pass, so fragments
+    like <scri<script></script>pt> come out as text rather than
+    recombining into a live tag.
+    """
+
+    def __init__(self):
+        # Keep entity/char refs as separate events so they pass through as is
+        super().__init__(convert_charrefs=False)
+        self.out: list[str] = []
+        self._raw_text_tag: str | None = None
+
+    def _emit_tag(self, tag, attrs, closing):
+        if self._raw_text_tag is not None or tag not in _SAFE_TAGS:
+            return
         safe_attrs = []
-        for am in _re.finditer(
-            r'([\w-]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|(\S+))', attr_str
-        ):
-            attr_name = am.group(1).lower()
-            attr_val = am.group(2) if am.group(2) is not None else (
-                am.group(3) if am.group(3) is not None else am.group(4)
-            )
-            if attr_name.startswith("on"):
+        for name, value in attrs:
+            # Valueless attributes (e.g. <td nowrap>) are dropped
+            if value is None or name.startswith("on") or name not in _SAFE_ATTRS:
                 continue
-            if attr_name not in _SAFE_ATTRS:
+            # Values arrive entity-decoded, so "jav&#x61;script:" is caught too
+            if name in ("href", "src", "action") and _DANGEROUS_URL_SCHEMES.match(
+                value.translate(_URL_IGNORED_CHARS)
+            ):
                 continue
-            if attr_name in ("href", "src", "action"):
-                if _DANGEROUS_URL_SCHEMES.match(attr_val):
-                    continue
-            safe_attrs.append(f'{attr_name}="{html.escape(attr_val, quote=True)}"')
-        closing = "/" if full.rstrip().endswith("/>") else ""
-        attrs = (" " + " ".join(safe_attrs)) if safe_attrs else ""
-        return f"<{tag_name}{attrs}{closing}>"
-
-    # Match HTML tags, handling quoted attributes that may contain '>'
-    _tag_re = _re.compile(
-        r'<(/?)(\w+)((?:\s+(?:[^>"\']*(?:"[^"]*"|\'[^\']*\'))*[^>"\']*)?)\s*/?>',
-    )
-    # Loop to handle nested tag bypass (e.g. <scri<script></script>pt>)
-    for _ in range(5):
-        result = _tag_re.sub(_replace_tag, html_str)
-        if result == html_str:
-            break
-        html_str = result
-    return html_str
+            safe_attrs.append(f' {name}="{html.escape(value, quote=True)}"')
+        self.out.append(f"<{tag}{''.join(safe_attrs)}{closing}>")
+
+    def handle_starttag(self, tag, attrs):
+        # Script/style bodies are raw text that may contain markup; drop them
+        if tag in self.CDATA_CONTENT_ELEMENTS:
+            self._raw_text_tag = tag
+        self._emit_tag(tag, attrs, "")
+
+    def handle_startendtag(self, tag, attrs):
+        self._emit_tag(tag, attrs, "/")
+
+    def handle_endtag(self, tag):
+        if tag == self._raw_text_tag:
+            self._raw_text_tag = None
+        elif self._raw_text_tag is None and tag in _SAFE_TAGS:
+            self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        # Includes stray "<" and unterminated tags, which must not stay live
+        if self._raw_text_tag is None:
+            self.out.append(html.escape(data, quote=False))
+
+    def handle_entityref(self, name):
+        if self._raw_text_tag is None:
+            self.out.append(f"&{name};")
+
+    def handle_charref(self, name):
+        if self._raw_text_tag is None:
+            self.out.append(f"&#{name};")
+
+
+# Sanitizing dominates cell extraction, and in --serve mode the same
+# outputs come back with every re-upload of an edited notebook, so results
+# are memoized on the (hashable) input string. The cache bounds entries,
+# not bytes, so outputs above this size (plotly figures run to megabytes)
+# are sanitized afresh rather than kept alive by it.
+_SANITIZE_CACHE_MAX_CHARS = 64 << 10
+
+
+def _sanitize_html(html_str: str) -> str:
+    """Allowlist-based HTML sanitizer: keeps only safe tags and attributes.
+
+    Comments, doctypes and the contents of <script>/<style> are dropped.
+    """
+    if len(html_str) > _SANITIZE_CACHE_MAX_CHARS:
+        return _sanitize_html_uncached(html_str)
+    return _sanitize_html_cached(html_str)
+
+
+def _sanitize_html_uncached(html_str: str) -> str:
+    """Run the sanitizing parser over *html_str* (see _sanitize_html)."""
+    parser = _SanitizingParser()
+    parser.feed(html_str)
+    parser.close()
+    return "".join(parser.out)
+
+
+_sanitize_html_cached = lru_cache(maxsize=128)(_sanitize_html_uncached)
+
+
+# Shared read-only default for .get() lookups in hot paths: a literal {} or
+# [] default is built on every call even when the key is present.
+_EMPTY = MappingProxyType({})
 
 
 def _extract_cell_data(cell: dict) -> dict:
     """Convert one notebook cell into the JS-friendly dict used by the template."""
     cell_type = cell.get("cell_type", "code")
-    source = _join(cell.get("source", []))
+    source = _join(cell.get("source", ()))
 
     if cell_type == "markdown":
         return {"type": "markdown", "content": source}
@@ -138,7 +279,7 @@ def _extract_cell_data(cell: dict) -> dict:
         return {"type": "markdown", "content": f"```\n{source}\n```"}
 
     # --- code cell ---
-    outputs = cell.get("outputs", [])
+    outputs = cell.get("outputs", ())
     text_parts = []
     html_parts = []
     image_parts = []  # list of {"data": base64str, "mime": "image/png"|"image/jpeg"}
@@ -148,31 +289,20 @@ def _extract_cell_data(cell: dict) -> dict:
         otype = out.get("output_type", "")
 
         if otype == "stream":
-            text_parts.append(_join(out.get("text", [])))
+            _extend_lines(text_parts, out.get("text"))
 
         elif otype in ("execute_result", "display_data"):
-            data = out.get("data", {})
+            data = out.get("data", _EMPTY)
             # Collect ALL representations present (not elif -- they can coexist)
             has_rich = False
             if "image/png" in data:
-                img_data = data["image/png"]
-                # Handle both string and list-of-strings
-                if isinstance(img_data, list):
-                    img_data = "".join(img_data)
-                # Strip whitespace/newlines from base64
-                image_parts.append({"data": img_data.strip(), "mime": "image/png"})
+                image_parts.append({"data": _collect_b64(data["image/png"]), "mime": "image/png"})
                 has_rich = True
             if "image/jpeg" in data:
-                img_data = data["image/jpeg"]
-                if isinstance(img_data, list):
-                    img_data = "".join(img_data)
-                image_parts.append({"data": img_data.strip(), "mime": "image/jpeg"})
+                image_parts.append({"data": _collect_b64(data["image/jpeg"]), "mime": "image/jpeg"})
                 has_rich = True
             if "image/gif" in data:
-                img_data = data["image/gif"]
-                if isinstance(img_data, list):
-                    img_data = "".join(img_data)
-                image_parts.append({"data": img_data.strip(), "mime": "image/gif"})
+                image_parts.append({"data": _collect_b64(data["image/gif"]), "mime": "image/gif"})
                 has_rich = True
             if "image/svg+xml" in data:
                 html_parts.append(_sanitize_html(_join(data["image/svg+xml"])))
@@ -190,101 +320,287 @@ def _extract_cell_data(cell: dict) -> dict:
             # use text/plain fallback when no other rich output was captured
             if "application/vnd.google.colaboratory.intrinsic+json" in data:
                 if not has_rich and "text/plain" in data:
-                    text_parts.append(_join(data["text/plain"]))
+                    _extend_lines(text_parts, data["text/plain"])
                 has_rich = True
             # Jupyter interactive widget – render the text fallback with a note
             if "application/vnd.jupyter.widget-view+json" in data:
-                widget_text = _join(data.get("text/plain", ""))
-                if widget_text:
-                    text_parts.append(widget_text)
+                _extend_lines(text_parts, data.get("text/plain"))
                 has_rich = True
             # Only use text/plain as fallback when no richer format exists
             if not has_rich and "text/plain" in data:
-                text_parts.append(_join(data["text/plain"]))
+                _extend_lines(text_parts, data["text/plain"])
 
         elif otype == "error":
-            tb = out.get("traceback", [])
-            # Strip ANSI escape sequences for readability
-            ansi_re = _re.compile(r"\x1b\[[0-9;:]*[A-Za-z]|\x1b\][^\x07]*(?:\x07|\x1b\\)")
-            for line in tb:
-                error_parts.append(ansi_re.sub("", line))
+            tb = out.get("traceback", ())
+            # Strip ANSI escape sequences for readability; the memchr-backed
+            # "in" test keeps plain lines away from the regex engine
+            error_parts.extend(
+                _ANSI_RE.sub("", line) if "\x1b" in line else line for line in tb
+            )
 
-    result: dict = {"type": "code", "content": source}
+    # Build combined output strings. Every code cell gets the same key set
+    # (None when absent) so the dicts share one key layout (PEP 412); the
+    # template treats null and missing fields alike.
+    return {
+        "type": "code",
+        "content": source,
+        "output": "".join(text_parts) or None,
+        "outputHtml": "".join(html_parts) or None,
+        "images": image_parts or None,
+        "error": "\n".join(error_parts) or None,
+        "executionCount": cell.get("execution_count"),
+    }
 
-    # Build combined output string
-    combined_text = "".join(text_parts)
-    combined_html = "".join(html_parts)
-    combined_images = image_parts
-    combined_error = "\n".join(error_parts)
 
-    if combined_text or combined_html or combined_images or combined_error:
-        result["output"] = combined_text if combined_text else None
-        result["outputHtml"] = combined_html if combined_html else None
-        result["images"] = combined_images if combined_images else None
-        result["error"] = combined_error if combined_error else None
+if orjson is not None:
+    def _dumps(obj) -> str:
+        """Serialize *obj* to compact JSON (orjson backend)."""
+        return orjson.dumps(obj).decode("utf-8")
 
-    # Execution count
-    ec = cell.get("execution_count")
-    if ec is not None:
-        result["executionCount"] = ec
+    _dumpb = orjson.dumps
+else:
+    def _dumps(obj) -> str:
+        """Serialize *obj* to compact JSON (stdlib backend)."""
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
 
-    return result
+    def _dumpb(obj) -> bytes:
+        """Serialize *obj* to compact UTF-8 JSON bytes (stdlib backend)."""
+        return _dumps(obj).encode("utf-8")
 
 
 def notebook_to_js_cells(nb: dict) -> str:
     """Return the notebook cells as a JSON array string for embedding in JS."""
-    cells = nb.get("cells", [])
-    js_cells = []
-    for cell in cells:
-        data = _extract_cell_data(cell)
-        # Skip empty code cells (no source content)
-        if data["type"] == "code" and not data.get("content", "").strip():
-            continue
-        js_cells.append(data)
-    return json.dumps(js_cells, ensure_ascii=False)
+    _, js_cells = _process_notebook(nb, None)
+    return _dumps(js_cells)
 
 
 def detect_kernel_language(nb: dict) -> str:
     """Best-effort detection of the notebook language for syntax highlighting."""
-    meta = nb.get("metadata", {})
-    ki = meta.get("kernelspec", {})
-    lang = ki.get("language", "").lower()
-    if lang:
-        return lang
-    li = meta.get("language_info", {})
-    return li.get("name", "python").lower()
+    meta = nb.get("metadata") or _EMPTY
+    try:
+        lang = meta["kernelspec"]["language"].lower()
+        if lang:
+            return lang
+    except (KeyError, TypeError, AttributeError):
+        pass
+    try:
+        return meta["language_info"]["name"].lower()
+    except (KeyError, TypeError, AttributeError):
+        return "python"
+
+
+# Languages with a Prism component loaded by the template
+_PRISM_LANGS = frozenset({
+    "python", "javascript", "r", "julia", "ruby", "bash", "sql",
+    "c", "cpp", "java", "go", "rust", "typescript", "scala",
+})
+
+# First line of the form "# Heading" (horizontal whitespace only, so a
+# bare "#" line never swallows the following line as its text).  The text
+# is matched greedily and right-stripped by the caller: a lazy group
+# followed by a trailing-whitespace run backtracks quadratically on long
+# lines with many inner spaces.
+_H1_RE = _re.compile(r"^[^\S\n]*# [^\S\n]*(\S.*)$", _re.MULTILINE)
+
+
+def _heading_title(source: str) -> str | None:
+    """Return the text of the first top-level ("# ") heading in *source*."""
+    m = _H1_RE.search(source)
+    return m.group(1).rstrip() if m else None
 
 
 def detect_title(nb: dict, fallback: str) -> str:
     """Try to extract a title from the first markdown cell's first heading."""
     for cell in nb.get("cells", []):
         if cell.get("cell_type") == "markdown":
-            source = _join(cell.get("source", []))
-            for line in source.splitlines():
-                stripped = line.strip()
-                if stripped.startswith("# "):
-                    return _re.sub(r'^#+\s*', '', stripped).strip()
-            break
+            return _heading_title(_join(cell.get("source", []))) or fallback
     return fallback
 
 
-def build_html(nb: dict, title: str | None = None) -> str:
-    """Build the full accessible HTML page from a parsed notebook."""
+def _is_blank_code(data: dict) -> bool:
+    """True for extracted code cells with no source (skipped in the output)."""
+    if data["type"] != "code":
+        return False
+    # isspace() answers the same question as strip() without copying
+    content = data["content"]
+    return not content or content.isspace()
+
+
+# Anything renderMarkdown or KaTeX auto-render would treat as math
+_MATH_RE = _re.compile(r"\$|\\[(\[]|\\begin\{")
+
+
+def _notebook_has_math(nb: dict) -> bool:
+    """True if any cell needs KaTeX (TeX in markdown/raw or text/latex output)."""
+    for cell in nb.get("cells", ()):
+        if cell.get("cell_type", "code") in ("markdown", "raw"):
+            if _MATH_RE.search(_join(cell.get("source", ()))):
+                return True
+            continue
+        for out in cell.get("outputs", ()):
+            latex = out.get("data", _EMPTY).get("text/latex")
+            if latex and _MATH_RE.search(_join(latex)):
+                return True
+    return False
+
+
+def _template_values(nb: dict, title: str | None) -> dict[str, str]:
+    """Return the non-cell template values (title, Prism language, KaTeX)."""
     language = detect_kernel_language(nb)
-    prism_lang = language if language in (
-        "python", "javascript", "r", "julia", "ruby", "bash", "sql",
-        "c", "cpp", "java", "go", "rust", "typescript", "scala",
-    ) else "python"
+    prism_lang = language if language in _PRISM_LANGS else "python"
+    return {
+        "TITLE": _maybe_escape(title or "Jupyter Notebook"),
+        "PRISM_LANG": prism_lang,
+        "KATEX_HEAD": _KATEX_HEAD if _notebook_has_math(nb) else "",
+    }
+
+
+def _process_notebook(nb: dict, title: str | None) -> tuple[dict[str, str], list[dict]]:
+    """Walk the cells once, returning the template values and JS cell dicts.
+
+    The title (unless overridden) is picked up from the first markdown cell
+    during the same pass that extracts cell data, as detect_title would.
+    """
+    nb_title = title
+    want_title = not title
+    js_cells = []
+    for cell in nb.get("cells", []):
+        data = _extract_cell_data(cell)
+        if want_title and cell.get("cell_type") == "markdown":
+            want_title = False
+            nb_title = _heading_title(data["content"])
+        if not _is_blank_code(data):
+            js_cells.append(data)
+    return _template_values(nb, nb_title), js_cells
+
+
+# Output images go into inert <template>s ahead of the viewer script rather
+# than the cells JSON: the HTML parser hands the base64 straight to the
+# <img>, so it is never scanned as a JS string literal or kept alive in
+# notebookCells. Payloads are validated by _collect_b64, so need no escaping.
+def _iter_image_templates(cells: Iterable[dict], kept: list) -> Iterator[str]:
+    """Yield one <template> per output image, appending each cell to *kept*.
+
+    Each cell's images are replaced by their indices among the templates.
+    """
+    n = 0
+    for data in cells:
+        images = data.get("images")
+        if images:
+            data["images"] = list(range(n, n + len(images)))
+            n += len(images)
+            for img in images:
+                yield (
+                    f'<template class="output-image"><img src="data:{img["mime"]};'
+                    f'base64,{img["data"]}" alt="Cell output image"></template>'
+                )
+        kept.append(data)
 
-    nb_title = title or detect_title(nb, "Jupyter Notebook")
-    cells_json = notebook_to_js_cells(nb)
+
+def build_html(nb: dict, title: str | None = None) -> str:
+    """Build the full accessible HTML page from a parsed notebook."""
+    values, js_cells = _process_notebook(nb, title)
+    # Rewrites the cells' images to template indices in place
+    values["IMAGES"] = "".join(_iter_image_templates(js_cells, []))
+    cells_json = _dumps(js_cells)
     # Escape </ so that sequences like </script> inside cell data don't
     # prematurely close the <script> block in the generated HTML.
-    cells_json = cells_json.replace("</", r"<\/")
+    values["CELLS_JSON"] = cells_json.replace("</", r"<\/")
 
-    return _HTML_TEMPLATE.replace("{{TITLE}}", html.escape(nb_title)).replace(
-        "{{PRISM_LANG}}", prism_lang
-    ).replace("{{CELLS_JSON}}", cells_json)
+    # Even indices are literal template text, odd indices placeholder names
+    return "".join([
+        values[part] if i % 2 else part
+        for i, part in enumerate(_TEMPLATE_PARTS)
+    ])
+
+
+def _iter_cells(nb: dict) -> Iterator[dict]:
+    """Lazily extract the non-blank cells of *nb*, one dict at a time."""
+    for cell in nb.get("cells", []):
+        data = _extract_cell_data(cell)
+        if not _is_blank_code(data):
+            yield data
+
+
+def _iter_html(values: dict[str, str], cells: Iterable[dict]) -> Iterator[str]:
+    """Yield the page in chunks: template text, image templates, cells JSON.
+
+    Image templates are yielded as cells are extracted, and each cell is
+    serialized on its own, so neither the images nor the cells JSON ever
+    exist as one string.
+    """
+    kept = []
+    for i, part in enumerate(_TEMPLATE_PARTS):
+        if not i % 2:
+            yield part
+        elif part == "IMAGES":
+            yield from _iter_image_templates(cells, kept)
+        elif part == "CELLS_JSON":
+            yield "["
+            sep = ""
+            for data in kept:
+                yield sep + _dumps(data).replace("</", r"<\/")
+                sep = ","
+            yield "]"
+        else:
+            yield values[part]
+
+
+def _iter_html_bytes(values: dict[str, str], cells: Iterable[dict]) -> Iterator[bytes]:
+    """Like _iter_html, but yield UTF-8 bytes for writing to a socket.
+
+    Static template text is encoded once at import and orjson output is
+    used as is, so the cells JSON is never decoded to str and back.
+    """
+    kept = []
+    for i, part in enumerate(_TEMPLATE_PARTS_BYTES):
+        if not i % 2:
+            yield part
+        elif part == b"IMAGES":
+            for tpl in _iter_image_templates(cells, kept):
+                yield tpl.encode("utf-8")
+        elif part == b"CELLS_JSON":
+            yield b"["
+            sep = b""
+            for data in kept:
+                yield sep + _dumpb(data).replace(b"</", rb"<\/")
+                sep = b","
+            yield b"]"
+        else:
+            yield values[_TEMPLATE_PARTS[i]].encode("utf-8")
+
+
+def write_html(nb: dict, fp, title: str | None = None) -> None:
+    """Stream the HTML page for *nb* to the text file object *fp*.
+
+    Unlike build_html, cells are extracted and serialized one at a time
+    straight into *fp*. Image payloads are written as they are found; only
+    the image-free cell dicts are held until the cells JSON.
+    """
+    # The title is written before any cell, so it cannot come from the
+    # extraction pass here; detect_title stops at the first markdown cell.
+    values = _template_values(nb, title or detect_title(nb, ""))
+    for chunk in _iter_html(values, _iter_cells(nb)):
+        fp.write(chunk)
+
+
+def _write_precompressed(path: Path) -> list[Path]:
+    """Write a .gz (and, with brotli installed, a .br) copy next to *path*.
+
+    Static servers set up for precompressed files (nginx gzip_static,
+    Caddy's precompressed) can then send these as-is, so the page is
+    compressed once at maximum level rather than on every request.
+    """
+    data = path.read_bytes()
+    written = [path.with_name(path.name + ".gz")]
+    # wbits=31 writes a gzip container with a zero mtime: reproducible output
+    # (compressobj rather than zlib.compress, whose wbits needs Python 3.11)
+    c = zlib.compressobj(9, zlib.DEFLATED, 31)
+    written[0].write_bytes(c.compress(data) + c.flush())
+    if brotli is not None:
+        written.append(path.with_name(path.name + ".br"))
+        written[1].write_bytes(brotli.compress(data, quality=11))
+    return written
 
 
 # ---------------------------------------------------------------------------
@@ -302,14 +618,10 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"></script>
     <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-{{PRISM_LANG}}.min.js"></script>
 
-    <!-- Marked for Markdown -->
-    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
-
-    <!-- KaTeX for math -->
-    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css">
-    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/contrib/auto-render.min.js"></script>
-
+    <!-- Marked for Markdown (only used from DOMContentLoaded onwards, so it
+         need not block parsing; deferred scripts run before that event) -->
+    <script defer src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></script>
+{{KATEX_HEAD}}
     <style>
         :root {
             /* High contrast color scheme */
@@ -466,11 +778,6 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             overflow: hidden;
         }
 
-        .cell:focus-within {
-            outline: 3px solid var(--accent-primary);
-            outline-offset: 2px;
-        }
-
         .cell-header {
             padding: 15px 20px;
             background: var(--bg-secondary);
@@ -582,25 +889,28 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             outline-offset: 2px;
         }
 
-        .markdown-content table {
+        /* Tables and images in markdown and HTML outputs share one look;
+           the output area tightens the spacing further down */
+        .markdown-content table, .output-area .html-output table {
             border-collapse: collapse;
             width: 100%;
             margin: 20px 0;
             font-size: var(--font-size-base);
         }
 
-        .markdown-content th, .markdown-content td {
+        .markdown-content th, .markdown-content td,
+        .output-area .html-output th, .output-area .html-output td {
             border: 2px solid var(--border-color);
             padding: 12px 15px;
             text-align: left;
         }
 
-        .markdown-content th {
+        .markdown-content th, .output-area .html-output th {
             background: var(--bg-secondary);
             font-weight: 700;
         }
 
-        .markdown-content img {
+        .markdown-content img, .output-area img {
             max-width: 100%;
             height: auto;
         }
@@ -716,7 +1026,9 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             overflow-y: auto;
         }
 
-        .output-area.hidden {
+        /* The second selector keeps a cell's existing output while its
+           spinner shows */
+        .output-area.hidden, .output-area.executing > :not(.loading) {
             display: none;
         }
 
@@ -733,22 +1045,15 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
         }
 
         .output-area .html-output table {
-            border-collapse: collapse;
-            font-size: var(--font-size-base);
-            width: 100%;
             margin: 10px 0;
         }
 
         .output-area .html-output th,
         .output-area .html-output td {
             padding: 10px 15px;
-            border: 2px solid var(--border-color);
-            text-align: left;
         }
 
         .output-area .html-output th {
-            background: var(--bg-secondary);
-            font-weight: 700;
             color: var(--text-primary);
         }
 
@@ -757,11 +1062,6 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             white-space: pre-wrap;
         }
 
-        .output-area img {
-            max-width: 100%;
-            height: auto;
-        }
-
         .execution-count {
             color: var(--text-secondary);
             font-size: var(--font-size-small);
@@ -783,7 +1083,7 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
         }
 
         /* Focus indicators */
-        *:focus {
+        *:focus, .cell:focus-within {
             outline: 3px solid var(--accent-primary);
             outline-offset: 2px;
         }
@@ -887,190 +1187,296 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
         <main id="main-content" role="main">
             <div id="notebook" role="region" aria-label="Notebook cells"></div>
         </main>
+        <div id="run-status" class="visually-hidden" role="status"></div>
     </div>
 
+    <!-- Cell scaffolding cloned by renderCell (kept free of whitespace nodes) -->
+    <template id="md-cell-tpl"><div class="cell markdown-cell" role="article"><div class="cell-content"><div class="markdown-content"></div></div></div></template>
+    <template id="code-cell-tpl"><div class="cell code-cell" role="article"><div class="cell-header"><span class="cell-number" aria-label="Cell number"></span></div><div class="cell-content"><div class="code-input" role="region" aria-label="Code input"><button class="run-button">Run Cell</button><pre><code></code></pre></div><div class="output-area hidden" role="region" aria-label="Cell output" aria-live="polite"></div></div></div></template>
+
+    <!-- Output images, referenced by index from notebookCells -->
+    {{IMAGES}}
+
     <script>
         // ---------- Notebook cell data (injected by jupyderp) ----------
         const notebookCells = {{CELLS_JSON}};
         const PRISM_LANG = "{{PRISM_LANG}}";
+        // Image templates above this script; cell.images indexes into them
+        const outputImages = document.querySelectorAll('template.output-image');
 
         let isExecuting = false;
         let currentCell = 0;
+        // Output areas of the rendered code cells by cell index, filled by
+        // renderCell so executeCell needs no id lookup
+        let outputAreas = [];
+        // Placeholders of cells not yet rendered, by cell index (long
+        // notebooks only), and the observer that renders them on approach
+        let placeholders = [];
+        let cellObserver = null;
+        let outputsCleared = false;
 
         // ---------- Helpers ----------
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
+        // Cheap probe so LaTeX outputs without TeX delimiters skip auto-render
+        function hasMathDelimiters(text) {
+            return text.indexOf('$') !== -1 || text.indexOf('\\(') !== -1 || text.indexOf('\\[') !== -1;
         }
 
-        var SAFE_TAGS = /^(?:a|abbr|b|blockquote|br|caption|code|col|colgroup|dd|del|details|dfn|div|dl|dt|em|figcaption|figure|h[1-6]|hr|i|img|ins|kbd|li|mark|ol|p|pre|q|rp|rt|ruby|s|samp|small|span|strong|sub|summary|sup|svg|table|tbody|td|tfoot|th|thead|tr|u|ul|var|wbr|circle|clippath|defs|ellipse|g|line|linearGradient|marker|mask|path|pattern|polygon|polyline|radialGradient|rect|stop|text|tspan)$/i;
-        var SAFE_ATTRS = /^(?:alt|border|cellpadding|cellspacing|class|colspan|dir|height|href|id|lang|name|role|rowspan|scope|src|style|summary|tabindex|title|valign|width|cx|cy|d|dx|dy|fill|fill-opacity|fill-rule|font-family|font-size|font-weight|gradientTransform|gradientUnits|markerHeight|markerWidth|offset|opacity|orient|patternUnits|points|preserveAspectRatio|r|refX|refY|rx|ry|stop-color|stop-opacity|stroke|stroke-dasharray|stroke-linecap|stroke-linejoin|stroke-opacity|stroke-width|text-anchor|transform|viewBox|x|x1|x2|xmlns|y|y1|y2)$/i;
+        // Shared by every auto-render call; auto-render copies its options
+        const KATEX_DELIMS = [
+            {left: '$$', right: '$$', display: true},
+            {left: '$', right: '$', display: false},
+            {left: '\\(', right: '\\)', display: false},
+            {left: '\\[', right: '\\]', display: true}
+        ];
+
+        var URL_ATTR_RE = /^(?:href|src|action)$/;
+        // Browsers skip leading C0 controls and spaces and drop tab, CR and
+        // LF anywhere in a URL before reading its scheme, so "java\tscript:"
+        // is checked as "javascript:" (as in _DANGEROUS_URL_SCHEMES)
+        var UNSAFE_URL_RE = /^[\x00-\x20]*(?:javascript|vbscript|data)\s*:/i;
+        var URL_IGNORED_RE = /[\t\n\r]/g;
+        // Most URLs (http:, relative, #anchor) are ruled out by their first
+        // character alone: controls, space, j, v and d are risky, and
+        // non-ASCII leads still go through the regex
+        var URL_RISKY_FIRST = new Uint8Array(128);
+        URL_RISKY_FIRST.fill(1, 0, 33);
+        [68, 74, 86, 100, 106, 118].forEach(function(c) { URL_RISKY_FIRST[c] = 1; });
+        function isUnsafeUrl(value) {
+            var c = value.charCodeAt(0);
+            return (c >= 128 || URL_RISKY_FIRST[c] === 1) &&
+                UNSAFE_URL_RE.test(value.replace(URL_IGNORED_RE, ''));
+        }
+        // Lowercase names; tagName is lowercased for lookup because SVG
+        // elements such as linearGradient keep their case
+        var SAFE_TAGS = new Set('a abbr b blockquote br caption code col colgroup dd del details dfn div dl dt em figcaption figure h1 h2 h3 h4 h5 h6 hr i img ins kbd li mark ol p pre q rp rt ruby s samp small span strong sub summary sup svg table tbody td tfoot th thead tr u ul var wbr circle clippath defs ellipse g line lineargradient marker mask path pattern polygon polyline radialgradient rect stop text tspan'.split(' '));
+        var SAFE_ATTRS = new Set('alt border cellpadding cellspacing class colspan dir height href id lang name role rowspan scope src style summary tabindex title valign width cx cy d dx dy fill fill-opacity fill-rule font-family font-size font-weight gradienttransform gradientunits markerheight markerwidth offset opacity orient patternunits points preserveaspectratio r refx refy rx ry stop-color stop-opacity stroke stroke-dasharray stroke-linecap stroke-linejoin stroke-opacity stroke-width text-anchor transform viewbox x x1 x2 xmlns y y1 y2'.split(' '));
         function sanitizeHtml(html) {
-            var tmp = document.createElement('div');
-            tmp.innerHTML = html;
-            function walk(node) {
-                var children = Array.from(node.childNodes);
-                for (var i = 0; i < children.length; i++) {
-                    var child = children[i];
-                    if (child.nodeType === 1) {
-                        if (!SAFE_TAGS.test(child.tagName)) {
-                            child.remove();
-                            continue;
-                        }
-                        var attrs = Array.from(child.attributes);
-                        for (var j = 0; j < attrs.length; j++) {
-                            var name = attrs[j].name.toLowerCase();
-                            if (name.startsWith('on') || !SAFE_ATTRS.test(name)) {
-                                child.removeAttribute(attrs[j].name);
-                            } else if (name === 'href' || name === 'src' || name === 'action') {
-                                if (/^\s*(?:javascript|vbscript|data)\s*:/i.test(attrs[j].value)) {
-                                    child.removeAttribute(attrs[j].name);
-                                }
-                            }
-                        }
-                        walk(child);
+            // Parse into an inert document so images don't load before sanitizing
+            var doc = new DOMParser().parseFromString(html, 'text/html');
+            var tmp = doc.body;
+            // Removals are deferred so the walker never loses its place
+            var walker = doc.createTreeWalker(tmp, NodeFilter.SHOW_ELEMENT);
+            var toRemove = [];
+            while (walker.nextNode()) {
+                var el = walker.currentNode;
+                if (!SAFE_TAGS.has(el.tagName.toLowerCase())) {
+                    toRemove.push(el);
+                    continue;
+                }
+                // Backwards, so removing an attribute never shifts one still
+                // to be visited
+                var attrs = el.attributes;
+                for (var j = attrs.length - 1; j >= 0; j--) {
+                    var attr = attrs[j];
+                    var name = attr.name.toLowerCase();
+                    if (!SAFE_ATTRS.has(name) ||
+                            (URL_ATTR_RE.test(name) && isUnsafeUrl(attr.value))) {
+                        el.removeAttribute(attr.name);
                     }
                 }
             }
-            walk(tmp);
+            for (var k = 0; k < toRemove.length; k++) toRemove[k].remove();
             return tmp.innerHTML;
         }
 
+        // One pass over the source; at any position display math ($$) is
+        // tried before inline ($), and inline math can neither contain nor
+        // end on a $$, so "$5 and $$x$$" still finds the display block
+        var MATH_STASH_RE = /\$\$[\s\S]*?\$\$|\\\[[\s\S]*?\\\]|\\begin\{([^}]+)\}[\s\S]*?\\end\{\1\}|\\\(.*?\\\)|(?<![\\$])\$(?!\$)[^$\n]+\$(?!\$)/g;
+
+        // Rendered markdown templates by source; reset re-renders
+        // identical cells, which then only costs a clone
+        var mdCache = new Map();
+
+        // Typeset one stashed block into target. KaTeX builds the DOM
+        // directly, skipping a serialize/re-parse round trip per equation
+        function renderMathBlock(block, target) {
+            var displayMode, body;
+            if (block.startsWith('$$')) {
+                displayMode = true;
+                body = block.slice(2, -2);
+            } else if (block.startsWith('\\[')) {
+                displayMode = true;
+                body = block.slice(2, -2);
+            } else if (block.startsWith('\\(')) {
+                displayMode = false;
+                body = block.slice(2, -2);
+            } else if (block.startsWith('$')) {
+                displayMode = false;
+                body = block.slice(1, -1);
+            }
+            if (typeof katex !== 'undefined' && body !== undefined) {
+                try {
+                    katex.render(body, target, {
+                        displayMode: displayMode,
+                        throwOnError: false
+                    });
+                    return;
+                } catch (e) { /* fallback to raw text */ }
+            }
+            target.textContent = block;
+        }
+
+        // Returns a DocumentFragment of the rendered cell
         function renderMarkdown(content) {
+            var hit = mdCache.get(content);
+            if (hit !== undefined) return hit.content.cloneNode(true);
             // Protect LaTeX blocks from marked.js processing.
             // marked.js interprets underscores as italics, asterisks as
             // bold, etc., which destroys LaTeX like x_{it}^{\text{dep}}
             // or \begin{align*}. We extract them first, run marked, then
             // restore them.
             var mathBlocks = [];
-            function stash(match) {
+            var safe = content.replace(MATH_STASH_RE, function(match, env) {
                 var id = '\x00MATH' + mathBlocks.length + '\x00';
-                mathBlocks.push(match);
+                // Bare environments are rendered as display math
+                mathBlocks.push(env ? '$$' + match + '$$' : match);
                 return id;
-            }
-            // Order matters: grab display math ($$) before inline ($)
-            var safe = content
-                .replace(/\$\$([\s\S]*?)\$\$/g, stash)
-                .replace(/\\\[([\s\S]*?)\\\]/g, stash)
-                .replace(/\\begin\{([^}]+)\}([\s\S]*?)\\end\{\1\}/g, function(m) { return stash('$$' + m + '$$'); })
-                .replace(/\\\((.*?)\\\)/g, stash)
-                .replace(/(?<![\\$])\$(?!\$)(.+?)\$/g, stash);
+            });
 
             var html = marked.parse(safe);
-
-            // Restore stashed math blocks, pre-rendering with KaTeX directly
-            // to avoid issues with renderMathInElement delimiter scanning on
-            // restored innerHTML.
-            for (var i = 0; i < mathBlocks.length; i++) {
-                var block = mathBlocks[i];
-                var rendered = block;
-                try {
-                    var displayMode, body;
-                    if (block.startsWith('$$')) {
-                        displayMode = true;
-                        body = block.slice(2, -2);
-                    } else if (block.startsWith('\\[')) {
-                        displayMode = true;
-                        body = block.slice(2, -2);
-                    } else if (block.startsWith('\\(')) {
-                        displayMode = false;
-                        body = block.slice(2, -2);
-                    } else if (block.startsWith('$')) {
-                        displayMode = false;
-                        body = block.slice(1, -1);
-                    }
-                    if (typeof katex !== 'undefined' && body !== undefined) {
-                        rendered = katex.renderToString(body, {
-                            displayMode: displayMode,
-                            throwOnError: false
-                        });
-                    }
-                } catch (e) { /* fallback to raw text */ }
-                html = html.split('\x00MATH' + i + '\x00').join(rendered);
+            var tpl = document.createElement('template');
+
+            // Restore stashed math blocks, pre-rendering with KaTeX
+            // directly to avoid issues with renderMathInElement delimiter
+            // scanning. Placeholders become empty spans that are typeset
+            // in place once the HTML has been parsed.
+            if (mathBlocks.length) {
+                tpl.innerHTML = html.replace(/\x00MATH(\d+)\x00/g, '<span data-math-id="$1"></span>');
+                tpl.content.querySelectorAll('span[data-math-id]').forEach(function(ph) {
+                    var block = mathBlocks[+ph.dataset.mathId];
+                    if (block === undefined) return;
+                    renderMathBlock(block, ph);
+                    ph.replaceWith(ph.firstChild);
+                });
+            } else {
+                tpl.innerHTML = html;
             }
 
-            return html;
+            // Math rendered before KaTeX loaded is raw text; don't pin it
+            if (!mathBlocks.length || typeof katex !== 'undefined') {
+                if (mdCache.size >= 256) mdCache.clear();
+                mdCache.set(content, tpl);
+            }
+            return tpl.content.cloneNode(true);
         }
 
         // ---------- Build output HTML from cell data ----------
-        function buildOutputHtml(cell) {
-            let parts = [];
+        // Cloned into every output area instead of parsing the markup
+        const outputLabel = document.createElement('span');
+        outputLabel.className = 'output-label';
+        outputLabel.textContent = 'Output:';
+
+        // Text outputs are set as text nodes, so only sanitized HTML
+        // outputs go through the parser; parts are newline-separated
+        function buildOutputNodes(cell) {
+            const frag = document.createDocumentFragment();
+            const label = frag.appendChild(outputLabel.cloneNode(true));
+            function add(node) {
+                if (frag.lastChild !== label) frag.appendChild(document.createTextNode('\n'));
+                frag.appendChild(node);
+            }
             if (cell.output) {
-                parts.push(escapeHtml(cell.output));
+                add(document.createTextNode(cell.output));
             }
             if (cell.outputHtml) {
-                parts.push('<div class="html-output">' + sanitizeHtml(cell.outputHtml) + '</div>');
+                const div = document.createElement('div');
+                div.className = 'html-output';
+                div.innerHTML = sanitizeHtml(cell.outputHtml);
+                add(div);
             }
             if (cell.images && cell.images.length) {
-                for (const img of cell.images) {
-                    var mime = (img && img.mime) ? img.mime : 'image/png';
-                    var b64 = (img && img.data) ? img.data : img;
-                    parts.push('<img src="data:' + mime + ';base64,' + b64 + '" alt="Cell output image">');
+                for (const n of cell.images) {
+                    add(outputImages[n].content.firstChild.cloneNode());
                 }
             }
             if (cell.error) {
-                parts.push('<div class="error-output">' + escapeHtml(cell.error) + '</div>');
+                const div = document.createElement('div');
+                div.className = 'error-output';
+                div.textContent = cell.error;
+                add(div);
             }
-            return parts.join('\n');
+            return frag;
         }
 
+        // Outputs never change, so the answer is kept on the cell
         function hasOutput(cell) {
-            return !!(cell.output || cell.outputHtml || (cell.images && cell.images.length) || cell.error);
+            if (cell._hasOutput === undefined) {
+                cell._hasOutput = !!(cell.output || cell.outputHtml || (cell.images && cell.images.length) || cell.error);
+            }
+            return cell._hasOutput;
         }
 
         // ---------- Render one cell ----------
+        // Cloning parsed <template> scaffolding is cheaper than parsing a
+        // fresh HTML string per cell; only markdown and outputs use innerHTML
+        const mdCellTpl = document.getElementById('md-cell-tpl').content.firstElementChild;
+        const codeCellTpl = document.getElementById('code-cell-tpl').content.firstElementChild;
+
         function renderCell(cell, index) {
-            const cellDiv = document.createElement('div');
-            cellDiv.className = 'cell ' + (cell.type === 'code' ? 'code-cell' : 'markdown-cell');
-            cellDiv.id = 'cell-' + index;
-            cellDiv.setAttribute('role', 'article');
-            cellDiv.setAttribute('aria-label', cell.type + ' cell ' + (index + 1));
+            let cellDiv;
 
             if (cell.type === 'markdown') {
-                cellDiv.innerHTML =
-                    '<div class="cell-content">' +
-                        '<div class="markdown-content">' +
-                            renderMarkdown(cell.content) +
-                        '</div>' +
-                    '</div>';
+                cellDiv = mdCellTpl.cloneNode(true);
+                cellDiv.querySelector('.markdown-content').appendChild(renderMarkdown(cell.content));
             } else {
-                const execLabel = cell.executionCount != null
+                cellDiv = codeCellTpl.cloneNode(true);
+                cellDiv.querySelector('.cell-number').textContent = cell.executionCount != null
                     ? 'In [' + cell.executionCount + ']:'
-                    : 'In [&nbsp;]:';
+                    : 'In [\u00a0]:';
+
+                const runButton = cellDiv.querySelector('.run-button');
+                runButton.setAttribute('aria-label', 'Run cell ' + (index + 1));
+                runButton.onclick = function() { executeCell(index); };
+
+                const code = cellDiv.querySelector('code');
+                code.className = 'language-' + PRISM_LANG;
+                code.textContent = cell.content;
 
                 // Show pre-computed output immediately if the cell has output
-                var outputVisible = hasOutput(cell);
-                var outputContent = outputVisible
-                    ? '<span class="output-label">Output:</span>' + buildOutputHtml(cell)
-                    : '';
-
-                cellDiv.innerHTML =
-                    '<div class="cell-header">' +
-                        '<span class="cell-number" aria-label="Cell number">' + execLabel + '</span>' +
-                    '</div>' +
-                    '<div class="cell-content">' +
-                        '<div class="code-input" role="region" aria-label="Code input">' +
-                            '<button class="run-button" onclick="executeCell(' + index + ')" ' +
-                                    'aria-label="Run cell ' + (index + 1) + '">' +
-                                'Run Cell' +
-                            '</button>' +
-                            '<pre><code class="language-' + PRISM_LANG + '">' + escapeHtml(cell.content) + '</code></pre>' +
-                        '</div>' +
-                        '<div class="output-area' + (outputVisible ? '' : ' hidden') + '" ' +
-                             'id="output-' + index + '" ' +
-                             'role="region" ' +
-                             'aria-label="Cell output" ' +
-                             'aria-live="polite">' +
-                            outputContent +
-                        '</div>' +
-                    '</div>';
+                const outputDiv = cellDiv.querySelector('.output-area');
+                outputDiv.id = 'output-' + index;
+                outputAreas[index] = outputDiv;
+                if (hasOutput(cell)) {
+                    outputDiv.classList.remove('hidden');
+                    outputDiv.appendChild(buildOutputNodes(cell));
+                }
             }
 
+            cellDiv.id = 'cell-' + index;
+            cellDiv.setAttribute('aria-label', cell.type + ' cell ' + (index + 1));
             return cellDiv;
         }
 
         // ---------- Execute a single cell ----------
+        // One shared spinner: only one cell executes at a time
+        const loadingNode = document.createElement('div');
+        loadingNode.className = 'loading';
+        loadingNode.innerHTML =
+            '<div class="loading-spinner"></div>' +
+            '<span>Executing cell...</span>';
+
+        // Re-running a cell leaves its output area unchanged, so results
+        // are announced through this polite status region instead
+        const runStatus = document.getElementById('run-status');
+
+        // Outputs are precomputed, so a run completes right away; set to
+        // true to bring back the randomized "execution" pause
+        const SIMULATE_DELAY = false;
+
+        function scheduleRun(fn) {
+            if (SIMULATE_DELAY) return setTimeout(fn, Math.random() * 800 + 400);
+            // Hidden tabs never fire rAF, so Run All falls back to a timer
+            if (document.hidden) return setTimeout(fn, 0);
+            // Wait out one frame so the executing state is actually painted
+            // (a microtask would finish before the browser ever renders it);
+            // the plain timer covers a tab hidden before that frame
+            var done = false;
+            function run() { if (!done) { done = true; fn(); } }
+            requestAnimationFrame(function() { setTimeout(run, 0); });
+            setTimeout(run, 100);
+        }
+
         function executeCell(index) {
             if (isExecuting) return;
 
@@ -1078,40 +1484,38 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             if (!cell || cell.type !== 'code') return;
 
             isExecuting = true;
-            var outputDiv = document.getElementById('output-' + index);
-            var cellDiv = document.getElementById('cell-' + index);
+            runStatus.textContent = '';
+            if (placeholders[index]) mountCell(index);
+            var outputDiv = outputAreas[index];
 
-            // Show loading spinner
+            // Show loading spinner over any output kept from an earlier run
             outputDiv.classList.remove('hidden');
-            outputDiv.innerHTML =
-                '<div class="loading">' +
-                    '<div class="loading-spinner"></div>' +
-                    '<span>Executing cell...</span>' +
-                '</div>';
-
-            // Simulate execution delay, then show output
-            setTimeout(function() {
-                if (hasOutput(cell)) {
-                    outputDiv.innerHTML =
-                        '<span class="output-label">Output:</span>' +
-                        buildOutputHtml(cell);
-                    // Render LaTeX in any latex-output divs
-                    if (typeof renderMathInElement !== 'undefined') {
-                        outputDiv.querySelectorAll('.latex-output').forEach(function(el) {
-                            renderMathInElement(el, {
-                                delimiters: [
-                                    {left: '$$', right: '$$', display: true},
-                                    {left: '$', right: '$', display: false},
-                                    {left: '\\(', right: '\\)', display: false},
-                                    {left: '\\[', right: '\\]', display: true}
-                                ]
-                            });
-                        });
+            outputDiv.classList.add('executing');
+            outputDiv.appendChild(loadingNode);
+
+            scheduleRun(function() {
+                loadingNode.remove();
+                outputDiv.classList.remove('executing');
+
+                // Outputs are fixed per cell, so nodes built by renderCell or
+                // a previous run are reused instead of re-parsed
+                if (!outputDiv.firstChild) {
+                    if (hasOutput(cell)) {
+                        outputDiv.appendChild(buildOutputNodes(cell));
+                        // Render LaTeX in any latex-output divs
+                        var latex = outputDiv.getElementsByClassName('latex-output');
+                        if (latex.length && typeof renderMathInElement !== 'undefined') {
+                            for (var k = 0; k < latex.length; k++) {
+                                if (hasMathDelimiters(latex[k].textContent)) {
+                                    renderMathInElement(latex[k], {delimiters: KATEX_DELIMS});
+                                }
+                            }
+                        }
+                    } else {
+                        outputDiv.innerHTML =
+                            '<span style="color: var(--text-secondary);">' +
+                            'Cell executed successfully (no output)</span>';
                     }
-                } else {
-                    outputDiv.innerHTML =
-                        '<span style="color: var(--text-secondary);">' +
-                        'Cell executed successfully (no output)</span>';
                 }
 
                 isExecuting = false;
@@ -1119,8 +1523,11 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
                 // If running all, advance to the next code cell
                 if (window.runningAll) {
                     advanceRunAll();
+                } else {
+                    runStatus.textContent = 'Cell ' + (index + 1) + ' of ' +
+                        notebookCells.length + ' executed';
                 }
-            }, Math.random() * 800 + 400);
+            });
         }
 
         // ---------- Run All Cells ----------
@@ -1141,6 +1548,17 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             }
         }
 
+        // Run the next cell as soon as the browser is idle (yielding to
+        // input) rather than after a fixed 300ms pause per cell
+        var scheduleIdle = window.requestIdleCallback
+            ? function(fn) { window.requestIdleCallback(fn, { timeout: 50 }); }
+            : function(fn) {
+                setTimeout(function() {
+                    var end = Date.now() + 8;
+                    fn({ timeRemaining: function() { return Math.max(0, end - Date.now()); } });
+                }, 0);
+            };
+
         function advanceRunAll() {
             currentCell++;
             // Skip to next code cell
@@ -1148,19 +1566,22 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
                 currentCell++;
             }
             if (currentCell < notebookCells.length) {
-                setTimeout(function() { executeCell(currentCell); }, 300);
+                scheduleIdle(function() { executeCell(currentCell); });
             } else {
                 window.runningAll = false;
+                runStatus.textContent = 'All cells executed';
             }
         }
 
         // ---------- Clear All Outputs ----------
         function clearOutputs() {
             window.runningAll = false;
-            document.querySelectorAll('.output-area').forEach(function(el) {
+            outputsCleared = true;
+            // Hide rather than tear down, so the next run reuses the nodes
+            outputAreas.forEach(function(el) {
                 el.classList.add('hidden');
-                el.innerHTML = '';
             });
+            runStatus.textContent = 'All outputs cleared';
         }
 
         // ---------- Reset Notebook ----------
@@ -1171,34 +1592,142 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
             initNotebook();
         }
 
+        // Tokenize code blocks a slice at a time so a long notebook stays
+        // responsive; blank blocks have nothing to tokenize
+        function highlightWhenIdle(nodes) {
+            var i = 0;
+            scheduleIdle(function step(deadline) {
+                do {
+                    var el = nodes[i++];
+                    if (!el.isConnected) return;  // notebook was reset
+                    if (/\S/.test(el.textContent)) Prism.highlightElement(el, false);
+                } while (i < nodes.length && deadline.timeRemaining() > 1);
+                if (i < nodes.length) scheduleIdle(step);
+            });
+        }
+
+        // ---------- Lazy rendering ----------
+        // Cells past this index start as sized placeholders and are
+        // rendered when they come within a screen or so of the viewport,
+        // during idle time after the first paint, or before printing
+        const EAGER_CELLS = 100;
+
+        function estimateCellHeight(cell) {
+            var lines = 1;
+            for (var i = cell.content.indexOf('\n'); i !== -1; i = cell.content.indexOf('\n', i + 1)) lines++;
+            return 40 + lines * 22 + (hasOutput(cell) ? 120 : 0);
+        }
+
+        function createPlaceholder(cell, index) {
+            const ph = document.createElement('div');
+            ph.className = 'cell-placeholder';
+            ph.dataset.idx = index;
+            ph.style.height = estimateCellHeight(cell) + 'px';
+            placeholders[index] = ph;
+            return ph;
+        }
+
+        // Swap a placeholder for its rendered cell, then highlight and
+        // typeset just that cell (right away when *sync*, e.g. for printing)
+        function mountCell(index, sync) {
+            const ph = placeholders[index];
+            delete placeholders[index];
+            cellObserver.unobserve(ph);
+            const cellDiv = renderCell(notebookCells[index], index);
+            if (outputsCleared && outputAreas[index]) outputAreas[index].classList.add('hidden');
+            ph.replaceWith(cellDiv);
+            decorateCells(cellDiv, sync);
+        }
+
+        // Fill in the remaining cells a slice at a time, so find-in-page and
+        // screen-reader browse mode soon see the whole notebook
+        function mountWhenIdle() {
+            var pending = placeholders;
+            var i = EAGER_CELLS;
+            scheduleIdle(function step(deadline) {
+                if (pending !== placeholders) return;  // notebook was reset
+                while (i < pending.length && deadline.timeRemaining() > 1) {
+                    if (pending[i]) mountCell(i);
+                    i++;
+                }
+                if (i < pending.length) scheduleIdle(step);
+            });
+        }
+
+        // Printing must not stop at the first placeholder, and the print
+        // snapshot is taken before any rAF or idle callback gets to run
+        window.addEventListener('beforeprint', function() {
+            placeholders.forEach(function(ph, index) { mountCell(index, true); });
+        });
+
         // ---------- Initialise ----------
         function initNotebook() {
             var container = document.getElementById('notebook');
-            container.innerHTML = '';
 
+            if (cellObserver) cellObserver.disconnect();
+            outputAreas = [];
+            placeholders = [];
+            outputsCleared = false;
+            var lazy = notebookCells.length > EAGER_CELLS && 'IntersectionObserver' in window;
+            cellObserver = lazy ? new IntersectionObserver(function(entries) {
+                entries.forEach(function(e) {
+                    if (e.isIntersecting && placeholders[e.target.dataset.idx] === e.target) mountCell(+e.target.dataset.idx);
+                });
+            }, { rootMargin: '1000px 0px' }) : null;
+
+            // Build every cell off-document, then swap them in with a
+            // single insertion so style/layout runs once, not per cell
+            var frag = document.createDocumentFragment();
             notebookCells.forEach(function(cell, index) {
-                container.appendChild(renderCell(cell, index));
+                frag.appendChild(lazy && index >= EAGER_CELLS
+                    ? createPlaceholder(cell, index)
+                    : renderCell(cell, index));
             });
+            container.replaceChildren(frag);
+            placeholders.forEach(function(ph) { cellObserver.observe(ph); });
 
-            // Apply syntax highlighting
-            if (typeof Prism !== 'undefined') {
-                Prism.highlightAll();
-            }
+            decorateCells(container);
+            if (lazy) mountWhenIdle();
+        }
 
-            // Render math in LaTeX outputs (markdown cells already
-            // pre-rendered via katex.renderToString in renderMarkdown)
-            if (typeof renderMathInElement !== 'undefined') {
-                document.querySelectorAll('.latex-output').forEach(function(el) {
-                    renderMathInElement(el, {
-                        delimiters: [
-                            {left: '$$', right: '$$', display: true},
-                            {left: '$', right: '$', display: false},
-                            {left: '\\(', right: '\\)', display: false},
-                            {left: '\\[', right: '\\]', display: true}
-                        ]
-                    });
-                });
+        function decorateCells(root, sync) {
+            if (sync) {
+                highlightCells(root, true);
+                typesetCells(root);
+                return;
             }
+            // Highlight and typeset in separate frames so each phase's DOM
+            // writes are batched into one layout pass instead of
+            // interleaving with the other's style reads
+            requestAnimationFrame(function() {
+                highlightCells(root, false);
+                requestAnimationFrame(function() { typesetCells(root); });
+            });
+        }
+
+        // Apply syntax highlighting, scoped to the new cells
+        function highlightCells(root, sync) {
+            var codeBlocks = root.querySelectorAll('pre > code[class*="language-"]');
+            if (typeof Prism === 'undefined' || !codeBlocks.length) return;
+            if (!sync) return highlightWhenIdle(codeBlocks);
+            codeBlocks.forEach(function(el) {
+                if (/\S/.test(el.textContent)) Prism.highlightElement(el, false);
+            });
+        }
+
+        // Render math in LaTeX outputs (markdown cells already typeset by
+        // katex.render in renderMarkdown)
+        function typesetCells(root) {
+            if (typeof renderMathInElement === 'undefined') return;
+            // Read pass first, then write, so no typeset node forces a
+            // synchronous layout for the next delimiter check
+            var pending = Array.prototype.filter.call(
+                root.getElementsByClassName('latex-output'),
+                function(el) { return hasMathDelimiters(el.textContent); }
+            );
+            pending.forEach(function(el) {
+                renderMathInElement(el, {delimiters: KATEX_DELIMS});
+            });
         }
 
         // Keyboard navigation: Ctrl+Enter runs focused cell
@@ -1221,6 +1750,50 @@ _HTML_TEMPLATE = r"""<!DOCTYPE html>
 </html>
 """
 
+# KaTeX assets, spliced into the template head only for notebooks that
+# contain math so math-free pages skip the CDN round trips entirely. The
+# stylesheet is preloaded and swapped in on load so it doesn't block first
+# paint, and the two most-used glyph fonts are fetched alongside it.
+_KATEX_HEAD = """
+    <!-- KaTeX for math -->
+    <link rel="preload" as="style" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css" onload="this.onload=null;this.rel='stylesheet'">
+    <noscript><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css"></noscript>
+    <link rel="preload" as="font" type="font/woff2" crossorigin href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/fonts/KaTeX_Main-Regular.woff2">
+    <link rel="preload" as="font" type="font/woff2" crossorigin href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/fonts/KaTeX_Math-Italic.woff2">
+    <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.js"></script>
+    <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/contrib/auto-render.min.js"></script>
+"""
+
+
+def _minify_css(css: str) -> str:
+    """Strip comments, redundant whitespace and final semicolons from *css*."""
+    css = _re.sub(r"/\*.*?\*/", "", css, flags=_re.S)
+    css = _re.sub(r"\s+", " ", css)
+    css = _re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    # Only after colons: a space before one can be a descendant combinator
+    css = _re.sub(r":\s+", ":", css)
+    css = css.replace(";}", "}")
+    css = _re.sub(r"#([0-9a-f])\1([0-9a-f])\2([0-9a-f])\3\b", r"#\1\2\3", css, flags=_re.I)
+    return css.strip()
+
+
+# The stylesheet stays readable in the template source and is minified once
+# here; the upload page's JS converter embeds the same string.
+_NOTEBOOK_CSS = _minify_css(
+    _re.search(r"<style>(.*?)</style>", _HTML_TEMPLATE, _re.S).group(1)
+)
+_HTML_TEMPLATE = _re.sub(
+    r"<style>.*?</style>", lambda m: "<style>" + _NOTEBOOK_CSS + "</style>",
+    _HTML_TEMPLATE, count=1, flags=_re.S,
+)
+
+# Split once at import so build_html assembles the page in a single join
+# instead of scanning the whole template once per placeholder.
+_TEMPLATE_PARTS = _re.split(
+    r"\{\{(TITLE|PRISM_LANG|KATEX_HEAD|IMAGES|CELLS_JSON)\}\}", _HTML_TEMPLATE
+)
+_TEMPLATE_PARTS_BYTES = [part.encode("utf-8") for part in _TEMPLATE_PARTS]
+
 
 # ---------------------------------------------------------------------------
 # Web interface HTML template
@@ -1572,331 +2145,321 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
         // Ports the Python conversion logic so everything runs in the browser.
         // =====================================================================
 
-        // ---------- Notebook HTML template (read from hidden script tag) ----------
-        // We build the template as a JS string to avoid escaping issues.
-        function getNotebookTemplate() {
-            return [
-'<!DOCTYPE html>',
-'<html lang="en">',
-'<head>',
-'    <meta charset="UTF-8">',
-'    <meta name="viewport" content="width=device-width, initial-scale=1.0">',
-'    <title>{{TITLE}}</title>',
-'',
-'    <!-- Prism for syntax highlighting with accessible theme -->',
-'    <link href="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism.min.css" rel="stylesheet" />',
-'    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"></' + 'script>',
-'    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-{{PRISM_LANG}}.min.js"></' + 'script>',
-'',
-'    <!-- Marked for Markdown -->',
-'    <script src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"></' + 'script>',
-'',
-'    <!-- KaTeX for math -->',
-'    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css">',
-'    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.js"></' + 'script>',
-'    <script src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/contrib/auto-render.min.js"></' + 'script>',
-'',
-'    <style>',
-'        :root {',
-'            --bg-primary: #ffffff;',
-'            --bg-secondary: #f5f5f5;',
-'            --bg-code: #1e1e1e;',
-'            --text-primary: #000000;',
-'            --text-secondary: #333333;',
-'            --text-code: #f8f8f2;',
-'            --accent-primary: #0066cc;',
-'            --accent-hover: #0052a3;',
-'            --border-color: #666666;',
-'            --output-bg: #fafafa;',
-'            --success-color: #008000;',
-'            --error-color: #cc0000;',
-'            --font-size-base: 18px;',
-'            --font-size-small: 16px;',
-'            --font-size-code: 16px;',
-'            --font-size-h1: 32px;',
-'            --font-size-h2: 28px;',
-'            --font-size-h3: 24px;',
-'            --line-height: 1.6;',
-'            --code-line-height: 1.8;',
-'        }',
-'        @media (prefers-color-scheme: dark) {',
-'            :root {',
-'                --bg-primary: #1a1a1a;',
-'                --bg-secondary: #2a2a2a;',
-'                --bg-code: #000000;',
-'                --text-primary: #ffffff;',
-'                --text-secondary: #e0e0e0;',
-'                --text-code: #f8f8f2;',
-'                --accent-primary: #4da6ff;',
-'                --accent-hover: #66b3ff;',
-'                --border-color: #999999;',
-'                --output-bg: #2a2a2a;',
-'                --success-color: #4caf50;',
-'                --error-color: #ff6b6b;',
-'            }',
-'        }',
-'        * { margin: 0; padding: 0; box-sizing: border-box; }',
-'        body {',
-'            font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif;',
-'            font-size: var(--font-size-base);',
-'            line-height: var(--line-height);',
-'            color: var(--text-primary);',
-'            background-color: var(--bg-primary);',
-'            padding: 20px;',
-'        }',
-'        .skip-link { position: absolute; top: -40px; left: 0; background: var(--accent-primary); color: white; padding: 8px; text-decoration: none; z-index: 100; }',
-'        .skip-link:focus { top: 0; }',
-'        .container { max-width: 1200px; margin: 0 auto; }',
-'        .header { background: linear-gradient(135deg, var(--accent-primary), var(--accent-hover)); color: white; padding: 30px; border-radius: 8px; margin-bottom: 30px; }',
-'        .header h1 { font-size: var(--font-size-h1); margin-bottom: 10px; font-weight: 600; }',
-'        .header p { font-size: var(--font-size-base); }',
-'        .toolbar { background: var(--bg-secondary); padding: 20px; border-radius: 8px; margin-bottom: 30px; border: 2px solid var(--border-color); display: flex; gap: 15px; flex-wrap: wrap; align-items: center; }',
-'        .btn { background: var(--accent-primary); color: white; border: 2px solid transparent; padding: 12px 24px; border-radius: 6px; cursor: pointer; font-size: var(--font-size-base); font-weight: 500; transition: all 0.2s ease; display: inline-flex; align-items: center; gap: 8px; min-height: 44px; }',
-'        .btn:hover, .btn:focus { background: var(--accent-hover); transform: translateY(-2px); box-shadow: 0 4px 8px rgba(0,0,0,0.2); outline: 3px solid var(--accent-primary); outline-offset: 2px; }',
-'        .btn:active { transform: translateY(0); }',
-'        .btn.secondary { background: #666666; }',
-'        .btn.secondary:hover, .btn.secondary:focus { background: #555555; }',
-'        .cell { background: var(--bg-primary); margin-bottom: 20px; border: 2px solid var(--border-color); border-radius: 8px; overflow: hidden; }',
-'        .cell:focus-within { outline: 3px solid var(--accent-primary); outline-offset: 2px; }',
-'        .cell-header { padding: 15px 20px; background: var(--bg-secondary); border-bottom: 2px solid var(--border-color); display: flex; justify-content: space-between; align-items: center; }',
-'        .cell-number { color: var(--text-secondary); font-size: var(--font-size-base); font-weight: 600; font-family: "Consolas", "Monaco", "Courier New", monospace; }',
-'        .cell-content { padding: 20px; }',
-'        .markdown-content { color: var(--text-primary); font-size: var(--font-size-base); line-height: var(--line-height); }',
-'        .markdown-content h1 { font-size: var(--font-size-h1); font-weight: 600; margin: 30px 0 20px 0; padding-bottom: 10px; border-bottom: 3px solid var(--border-color); }',
-'        .markdown-content h2 { font-size: var(--font-size-h2); font-weight: 600; margin: 25px 0 15px 0; }',
-'        .markdown-content h3 { font-size: var(--font-size-h3); font-weight: 600; margin: 20px 0 10px 0; }',
-'        .markdown-content p { margin-bottom: 15px; line-height: var(--line-height); }',
-'        .markdown-content ul, .markdown-content ol { margin: 15px 0 15px 30px; line-height: var(--line-height); }',
-'        .markdown-content li { margin-bottom: 8px; line-height: var(--line-height); }',
-'        .markdown-content strong { font-weight: 700; color: var(--text-primary); }',
-'        .markdown-content em { font-style: italic; }',
-'        .markdown-content code { background: var(--bg-secondary); padding: 3px 8px; border-radius: 4px; font-family: "Consolas", "Monaco", "Courier New", monospace; font-size: var(--font-size-code); border: 1px solid var(--border-color); }',
-'        .markdown-content pre { background: var(--bg-code); color: var(--text-code); padding: 20px; border-radius: 8px; overflow-x: auto; margin: 20px 0; font-size: var(--font-size-code); line-height: var(--code-line-height); border: 2px solid var(--border-color); }',
-'        .markdown-content pre code { background: none; border: none; padding: 0; color: inherit; }',
-'        .markdown-content a { color: var(--accent-primary); text-decoration: underline; font-weight: 500; }',
-'        .markdown-content a:hover, .markdown-content a:focus { color: var(--accent-hover); outline: 2px solid var(--accent-primary); outline-offset: 2px; }',
-'        .markdown-content table { border-collapse: collapse; width: 100%; margin: 20px 0; font-size: var(--font-size-base); }',
-'        .markdown-content th, .markdown-content td { border: 2px solid var(--border-color); padding: 12px 15px; text-align: left; }',
-'        .markdown-content th { background: var(--bg-secondary); font-weight: 700; }',
-'        .markdown-content img { max-width: 100%; height: auto; }',
-'        .code-input { background: var(--bg-code); border-radius: 8px; padding: 20px; margin-bottom: 10px; position: relative; border: 2px solid var(--border-color); }',
-'        .code-input pre { margin: 0; color: var(--text-code); font-family: "Consolas", "Monaco", "Courier New", monospace; font-size: var(--font-size-code); line-height: var(--code-line-height); overflow-x: auto; }',
-'        .code-input code { font-size: var(--font-size-code) !important; line-height: var(--code-line-height) !important; font-family: "Consolas", "Monaco", "Courier New", monospace !important; }',
-'        .token.comment { color: #6a9955; font-style: italic; }',
-'        .token.string { color: #ce9178; }',
-'        .token.keyword { color: #569cd6; font-weight: 600; }',
-'        .token.function { color: #dcdcaa; }',
-'        .token.number { color: #b5cea8; }',
-'        .token.operator { color: #d4d4d4; }',
-'        .run-button { position: absolute; top: 10px; right: 10px; background: var(--accent-primary); color: white; border: 2px solid white; padding: 8px 16px; border-radius: 6px; font-size: var(--font-size-small); font-weight: 600; cursor: pointer; min-height: 44px; }',
-'        .run-button:hover, .run-button:focus { background: var(--accent-hover); outline: 3px solid white; outline-offset: 2px; }',
-'        .loading { display: flex; align-items: center; gap: 12px; color: var(--text-secondary); font-size: var(--font-size-base); padding: 10px 0; }',
-'        .loading-spinner { width: 24px; height: 24px; border: 3px solid var(--border-color); border-top-color: var(--accent-primary); border-radius: 50%; animation: spin 0.8s linear infinite; }',
-'        @keyframes spin { to { transform: rotate(360deg); } }',
-'        .output-area { background: var(--output-bg); border: 2px solid var(--border-color); border-radius: 8px; padding: 20px; margin-top: 15px; font-family: "Consolas", "Monaco", "Courier New", monospace; font-size: var(--font-size-code); line-height: var(--code-line-height); color: var(--text-primary); white-space: pre-wrap; word-wrap: break-word; max-height: 500px; overflow-y: auto; }',
-'        .output-area.hidden { display: none; }',
-'        .output-label { display: block; font-weight: 600; margin-bottom: 10px; color: var(--text-secondary); font-size: var(--font-size-small); }',
-'        .output-area .html-output { font-family: -apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; }',
-'        .output-area .html-output table { border-collapse: collapse; font-size: var(--font-size-base); width: 100%; margin: 10px 0; }',
-'        .output-area .html-output th, .output-area .html-output td { padding: 10px 15px; border: 2px solid var(--border-color); text-align: left; }',
-'        .output-area .html-output th { background: var(--bg-secondary); font-weight: 700; color: var(--text-primary); }',
-'        .output-area .error-output { color: var(--error-color); white-space: pre-wrap; }',
-'        .output-area img { max-width: 100%; height: auto; }',
-'        .execution-count { color: var(--text-secondary); font-size: var(--font-size-small); margin-top: 10px; font-style: italic; }',
-'        .visually-hidden { position: absolute; width: 1px; height: 1px; padding: 0; margin: -1px; overflow: hidden; clip: rect(0,0,0,0); white-space: nowrap; border-width: 0; }',
-'        *:focus { outline: 3px solid var(--accent-primary); outline-offset: 2px; }',
-'        @media print { body { font-size: 12pt; line-height: 1.5; } .toolbar, .run-button { display: none; } .cell { page-break-inside: avoid; } }',
-'        @media (prefers-contrast: high) { :root { --border-color: #000000; --accent-primary: #0000ff; --bg-code: #000000; --text-code: #ffffff; --success-color: #006400; --error-color: #cc0000; } }',
-'        @media (prefers-contrast: high) and (prefers-color-scheme: dark) { :root { --border-color: #ffffff; --accent-primary: #6699ff; --bg-code: #000000; --text-code: #ffffff; --success-color: #66ff66; --error-color: #ff6666; } }',
-'        @media (prefers-reduced-motion: reduce) { * { animation-duration: 0.01ms !important; animation-iteration-count: 1 !important; transition-duration: 0.01ms !important; } }',
-'        @media (max-width: 768px) { body { font-size: 16px; padding: 10px; } .header { padding: 20px; } .toolbar { flex-direction: column; align-items: stretch; } .btn { width: 100%; justify-content: center; } .code-input pre { font-size: 14px; } }',
-'    </style>',
-'</head>',
-'<body>',
-'    <a href="#main-content" class="skip-link">Skip to main content</a>',
-'    <div class="container">',
-'        <header class="header" role="banner">',
-'            <h1>{{TITLE}}</h1>',
-'            <p>Interactive accessible notebook viewer &mdash; generated by jupyderp</p>',
-'        </header>',
-'        <nav class="toolbar" role="navigation" aria-label="Notebook controls">',
-'            <button class="btn" onclick="runAllCells()" aria-label="Run all code cells">',
-'                <span aria-hidden="true">&#9654;</span> Run All Cells',
-'            </button>',
-'            <button class="btn secondary" onclick="clearOutputs()" aria-label="Clear all cell outputs">',
-'                <span aria-hidden="true">&#9003;</span> Clear All Outputs',
-'            </button>',
-'            <button class="btn secondary" onclick="resetNotebook()" aria-label="Reset notebook to initial state">',
-'                <span aria-hidden="true">&#8635;</span> Reset Notebook',
-'            </button>',
-'        </nav>',
-'        <main id="main-content" role="main">',
-'            <div id="notebook" role="region" aria-label="Notebook cells"></div>',
-'        </main>',
-'    </div>',
-'    <script>',
-'        const notebookCells = {{CELLS_JSON}};',
-'        const PRISM_LANG = "{{PRISM_LANG}}";',
-'        let isExecuting = false;',
-'        let currentCell = 0;',
-'        function escapeHtml(text) {',
-'            const div = document.createElement("div");',
-'            div.textContent = text;',
-'            return div.innerHTML;',
-'        }',
-'        var SAFE_TAGS = /^(?:a|abbr|b|blockquote|br|caption|code|col|colgroup|dd|del|details|dfn|div|dl|dt|em|figcaption|figure|h[1-6]|hr|i|img|ins|kbd|li|mark|ol|p|pre|q|rp|rt|ruby|s|samp|small|span|strong|sub|summary|sup|svg|table|tbody|td|tfoot|th|thead|tr|u|ul|var|wbr|circle|clippath|defs|ellipse|g|line|linearGradient|marker|mask|path|pattern|polygon|polyline|radialGradient|rect|stop|text|tspan)$/i;',
-'        var SAFE_ATTRS = /^(?:alt|border|cellpadding|cellspacing|class|colspan|dir|height|href|id|lang|name|role|rowspan|scope|src|style|summary|tabindex|title|valign|width|cx|cy|d|dx|dy|fill|fill-opacity|fill-rule|font-family|font-size|font-weight|gradientTransform|gradientUnits|markerHeight|markerWidth|offset|opacity|orient|patternUnits|points|preserveAspectRatio|r|refX|refY|rx|ry|stop-color|stop-opacity|stroke|stroke-dasharray|stroke-linecap|stroke-linejoin|stroke-opacity|stroke-width|text-anchor|transform|viewBox|x|x1|x2|xmlns|y|y1|y2)$/i;',
-'        function sanitizeHtml(h) {',
-'            var tmp = document.createElement("div"); tmp.innerHTML = h;',
-'            function walk(node) { var ch = Array.from(node.childNodes); for (var i = 0; i < ch.length; i++) { var c = ch[i]; if (c.nodeType === 1) { if (!SAFE_TAGS.test(c.tagName)) { c.remove(); continue; } var attrs = Array.from(c.attributes); for (var j = 0; j < attrs.length; j++) { var n = attrs[j].name.toLowerCase(); if (n.startsWith("on") || !SAFE_ATTRS.test(n)) { c.removeAttribute(attrs[j].name); } else if (n === "href" || n === "src" || n === "action") { if (/^\\s*(?:javascript|vbscript|data)\\s*:/i.test(attrs[j].value)) { c.removeAttribute(attrs[j].name); } } } walk(c); } } }',
-'            walk(tmp); return tmp.innerHTML;',
-'        }',
-'        function renderMarkdown(content) {',
-'            var mathBlocks = [];',
-'            function stash(match) { var id = "\\x00MATH" + mathBlocks.length + "\\x00"; mathBlocks.push(match); return id; }',
-'            var safe = content',
-'                .replace(/\\$\\$([\\s\\S]*?)\\$\\$/g, stash)',
-'                .replace(/\\\\\\[([\\s\\S]*?)\\\\\\]/g, stash)',
-'                .replace(/\\\\begin\\{([^}]+)\\}([\\s\\S]*?)\\\\end\\{\\1\\}/g, function(m) { return stash("$$" + m + "$$"); })',
-'                .replace(/\\\\\\((.*?)\\\\\\)/g, stash)',
-'                .replace(/(?<![\\\\$])\\$(?!\\$)(.+?)\\$/g, stash);',
-'            var html = marked.parse(safe);',
-'            for (var i = 0; i < mathBlocks.length; i++) {',
-'                var block = mathBlocks[i]; var rendered = block;',
-'                try {',
-'                    var displayMode, body;',
-'                    if (block.startsWith("$$")) { displayMode = true; body = block.slice(2, -2); }',
-'                    else if (block.startsWith("\\\\[")) { displayMode = true; body = block.slice(2, -2); }',
-'                    else if (block.startsWith("\\\\(")) { displayMode = false; body = block.slice(2, -2); }',
-'                    else if (block.startsWith("$")) { displayMode = false; body = block.slice(1, -1); }',
-'                    if (typeof katex !== "undefined" && body !== undefined) {',
-'                        rendered = katex.renderToString(body, { displayMode: displayMode, throwOnError: false });',
-'                    }',
-'                } catch (e) {}',
-'                html = html.split("\\x00MATH" + i + "\\x00").join(rendered);',
-'            }',
-'            return html;',
-'        }',
-'        function buildOutputHtml(cell) {',
-'            var parts = [];',
-'            if (cell.output) { parts.push(escapeHtml(cell.output)); }',
-'            if (cell.outputHtml) { parts.push("<div class=\\"html-output\\">" + sanitizeHtml(cell.outputHtml) + "</div>"); }',
-'            if (cell.images && cell.images.length) {',
-'                for (var i = 0; i < cell.images.length; i++) {',
-'                    var mime = (cell.images[i] && cell.images[i].mime) ? cell.images[i].mime : "image/png";',
-'                    var b64 = (cell.images[i] && cell.images[i].data) ? cell.images[i].data : cell.images[i];',
-'                    parts.push("<img src=\\"data:" + mime + ";base64," + b64 + "\\" alt=\\"Cell output image\\">");',
-'                }',
-'            }',
-'            if (cell.error) { parts.push("<div class=\\"error-output\\">" + escapeHtml(cell.error) + "</div>"); }',
-'            return parts.join("\\n");',
-'        }',
-'        function hasOutput(cell) {',
-'            return !!(cell.output || cell.outputHtml || (cell.images && cell.images.length) || cell.error);',
-'        }',
-'        function renderCell(cell, index) {',
-'            var cellDiv = document.createElement("div");',
-'            cellDiv.className = "cell " + (cell.type === "code" ? "code-cell" : "markdown-cell");',
-'            cellDiv.id = "cell-" + index;',
-'            cellDiv.setAttribute("role", "article");',
-'            cellDiv.setAttribute("aria-label", cell.type + " cell " + (index + 1));',
-'            if (cell.type === "markdown") {',
-'                cellDiv.innerHTML = "<div class=\\"cell-content\\"><div class=\\"markdown-content\\">" + renderMarkdown(cell.content) + "</div></div>";',
-'            } else {',
-'                var execLabel = cell.executionCount != null ? "In [" + cell.executionCount + "]:" : "In [&nbsp;]:";',
-'                var outputVisible = hasOutput(cell);',
-'                var outputContent = outputVisible ? "<span class=\\"output-label\\">Output:</span>" + buildOutputHtml(cell) : "";',
-'                cellDiv.innerHTML =',
-'                    "<div class=\\"cell-header\\"><span class=\\"cell-number\\" aria-label=\\"Cell number\\">" + execLabel + "</span></div>" +',
-'                    "<div class=\\"cell-content\\"><div class=\\"code-input\\" role=\\"region\\" aria-label=\\"Code input\\">" +',
-'                    "<button class=\\"run-button\\" onclick=\\"executeCell(" + index + ")\\" aria-label=\\"Run cell " + (index + 1) + "\\">Run Cell</button>" +',
-'                    "<pre><code class=\\"language-" + PRISM_LANG + "\\">" + escapeHtml(cell.content) + "</code></pre>" +',
-'                    "</div><div class=\\"output-area" + (outputVisible ? "" : " hidden") + "\\" id=\\"output-" + index + "\\" role=\\"region\\" aria-label=\\"Cell output\\" aria-live=\\"polite\\">" + outputContent + "</div></div>";',
-'            }',
-'            return cellDiv;',
-'        }',
-'        function executeCell(index) {',
-'            if (isExecuting) return;',
-'            var cell = notebookCells[index];',
-'            if (!cell || cell.type !== "code") return;',
-'            isExecuting = true;',
-'            var outputDiv = document.getElementById("output-" + index);',
-'            outputDiv.classList.remove("hidden");',
-'            outputDiv.innerHTML = "<div class=\\"loading\\"><div class=\\"loading-spinner\\"></div><span>Executing cell...</span></div>";',
-'            setTimeout(function() {',
-'                if (hasOutput(cell)) {',
-'                    outputDiv.innerHTML = "<span class=\\"output-label\\">Output:</span>" + buildOutputHtml(cell);',
-'                    if (typeof renderMathInElement !== "undefined") {',
-'                        outputDiv.querySelectorAll(".latex-output").forEach(function(el) {',
-'                            renderMathInElement(el, {',
-'                                delimiters: [',
-'                                    {left: "$$", right: "$$", display: true},',
-'                                    {left: "$", right: "$", display: false},',
-'                                    {left: "\\\\(", right: "\\\\)", display: false},',
-'                                    {left: "\\\\[", right: "\\\\]", display: true}',
-'                                ]',
-'                            });',
-'                        });',
-'                    }',
-'                } else {',
-'                    outputDiv.innerHTML = "<span style=\\"color: var(--text-secondary);\\">Cell executed successfully (no output)</span>";',
-'                }',
-'                isExecuting = false;',
-'                if (window.runningAll) { advanceRunAll(); }',
-'            }, Math.random() * 800 + 400);',
-'        }',
-'        function runAllCells() {',
-'            if (isExecuting) return;',
-'            window.runningAll = true;',
-'            currentCell = 0;',
-'            while (currentCell < notebookCells.length && notebookCells[currentCell].type !== "code") { currentCell++; }',
-'            if (currentCell < notebookCells.length) { executeCell(currentCell); } else { window.runningAll = false; }',
-'        }',
-'        function advanceRunAll() {',
-'            currentCell++;',
-'            while (currentCell < notebookCells.length && notebookCells[currentCell].type !== "code") { currentCell++; }',
-'            if (currentCell < notebookCells.length) { setTimeout(function() { executeCell(currentCell); }, 300); } else { window.runningAll = false; }',
-'        }',
-'        function clearOutputs() {',
-'            window.runningAll = false;',
-'            document.querySelectorAll(".output-area").forEach(function(el) { el.classList.add("hidden"); el.innerHTML = ""; });',
-'        }',
-'        function resetNotebook() {',
-'            window.runningAll = false;',
-'            isExecuting = false;',
-'            currentCell = 0;',
-'            initNotebook();',
-'        }',
-'        function initNotebook() {',
-'            var container = document.getElementById("notebook");',
-'            container.innerHTML = "";',
-'            notebookCells.forEach(function(cell, index) { container.appendChild(renderCell(cell, index)); });',
-'            if (typeof Prism !== "undefined") { Prism.highlightAll(); }',
-'            if (typeof renderMathInElement !== "undefined") {',
-'                document.querySelectorAll(".latex-output").forEach(function(el) {',
-'                    renderMathInElement(el, {',
-'                        delimiters: [',
-'                            {left: "$$", right: "$$", display: true},',
-'                            {left: "$", right: "$", display: false},',
-'                            {left: "\\\\(", right: "\\\\)", display: false},',
-'                            {left: "\\\\[", right: "\\\\]", display: true}',
-'                        ]',
-'                    });',
-'                });',
-'            }',
-'        }',
-'        document.addEventListener("keydown", function(e) {',
-'            if (e.ctrlKey && e.key === "Enter") {',
-'                var focusedCell = document.activeElement.closest(".cell");',
-'                if (focusedCell) { var cellId = parseInt(focusedCell.id.replace("cell-", "")); executeCell(cellId); }',
-'            }',
-'        });',
-'        document.addEventListener("DOMContentLoaded", function() { initNotebook(); });',
-'    </' + 'script>',
-'</body>',
-'</html>'
-            ].join('\n');
+        // ---------- Notebook HTML template ----------
+        // Minified viewer stylesheet, filled in by jupyderp.py from the
+        // same source as the Python converter's template
+        var NOTEBOOK_CSS = {{NOTEBOOK_CSS}};
+
+        // One template literal, assembled once when this page loads;
+        // closing script tags are written <\/script> so they can't end
+        // this block
+        var NOTEBOOK_TEMPLATE = `<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{{TITLE}}</title>
+
+    <!-- Prism for syntax highlighting with accessible theme -->
+    <link href="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/themes/prism.min.css" rel="stylesheet" />
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/prism.min.js"><\/script>
+    <script src="https://cdnjs.cloudflare.com/ajax/libs/prism/1.29.0/components/prism-{{PRISM_LANG}}.min.js"><\/script>
+
+    <!-- Marked for Markdown -->
+    <script defer src="https://cdn.jsdelivr.net/npm/marked/marked.min.js"><\/script>
+{{KATEX_HEAD}}
+    <style>${NOTEBOOK_CSS}</style>
+</head>
+<body>
+    <a href="#main-content" class="skip-link">Skip to main content</a>
+    <div class="container">
+        <header class="header" role="banner">
+            <h1>{{TITLE}}</h1>
+            <p>Interactive accessible notebook viewer &mdash; generated by jupyderp</p>
+        </header>
+        <nav class="toolbar" role="navigation" aria-label="Notebook controls">
+            <button class="btn" onclick="runAllCells()" aria-label="Run all code cells">
+                <span aria-hidden="true">&#9654;</span> Run All Cells
+            </button>
+            <button class="btn secondary" onclick="clearOutputs()" aria-label="Clear all cell outputs">
+                <span aria-hidden="true">&#9003;</span> Clear All Outputs
+            </button>
+            <button class="btn secondary" onclick="resetNotebook()" aria-label="Reset notebook to initial state">
+                <span aria-hidden="true">&#8635;</span> Reset Notebook
+            </button>
+        </nav>
+        <main id="main-content" role="main">
+            <div id="notebook" role="region" aria-label="Notebook cells"></div>
+        </main>
+        <div id="run-status" class="visually-hidden" role="status"></div>
+    </div>
+    <template id="md-cell-tpl"><div class="cell markdown-cell" role="article"><div class="cell-content"><div class="markdown-content"></div></div></div></template>
+    <template id="code-cell-tpl"><div class="cell code-cell" role="article"><div class="cell-header"><span class="cell-number" aria-label="Cell number"></span></div><div class="cell-content"><div class="code-input" role="region" aria-label="Code input"><button class="run-button">Run Cell</button><pre><code></code></pre></div><div class="output-area hidden" role="region" aria-label="Cell output" aria-live="polite"></div></div></div></template>
+    {{IMAGES}}
+    <script>
+        const notebookCells = {{CELLS_JSON}};
+        const PRISM_LANG = "{{PRISM_LANG}}";
+        const outputImages = document.querySelectorAll("template.output-image");
+        let isExecuting = false;
+        let currentCell = 0;
+        let outputAreas = [];
+        let placeholders = [];
+        let cellObserver = null;
+        let outputsCleared = false;
+        function hasMathDelimiters(text) {
+            return text.indexOf("$") !== -1 || text.indexOf("\\\\(") !== -1 || text.indexOf("\\\\[") !== -1;
+        }
+        const KATEX_DELIMS = [
+            {left: "$$", right: "$$", display: true},
+            {left: "$", right: "$", display: false},
+            {left: "\\\\(", right: "\\\\)", display: false},
+            {left: "\\\\[", right: "\\\\]", display: true}
+        ];
+        var SAFE_TAGS = new Set("a abbr b blockquote br caption code col colgroup dd del details dfn div dl dt em figcaption figure h1 h2 h3 h4 h5 h6 hr i img ins kbd li mark ol p pre q rp rt ruby s samp small span strong sub summary sup svg table tbody td tfoot th thead tr u ul var wbr circle clippath defs ellipse g line lineargradient marker mask path pattern polygon polyline radialgradient rect stop text tspan".split(" "));
+        var SAFE_ATTRS = new Set("alt border cellpadding cellspacing class colspan dir height href id lang name role rowspan scope src style summary tabindex title valign width cx cy d dx dy fill fill-opacity fill-rule font-family font-size font-weight gradienttransform gradientunits markerheight markerwidth offset opacity orient patternunits points preserveaspectratio r refx refy rx ry stop-color stop-opacity stroke stroke-dasharray stroke-linecap stroke-linejoin stroke-opacity stroke-width text-anchor transform viewbox x x1 x2 xmlns y y1 y2".split(" "));
+        var URL_ATTR_RE = /^(?:href|src|action)$/;
+        var UNSAFE_URL_RE = /^[\\x00-\\x20]*(?:javascript|vbscript|data)\\s*:/i;
+        var URL_IGNORED_RE = /[\\t\\n\\r]/g;
+        var URL_RISKY_FIRST = new Uint8Array(128);
+        URL_RISKY_FIRST.fill(1, 0, 33);
+        [68, 74, 86, 100, 106, 118].forEach(function(c) { URL_RISKY_FIRST[c] = 1; });
+        function isUnsafeUrl(value) { var c = value.charCodeAt(0); return (c >= 128 || URL_RISKY_FIRST[c] === 1) && UNSAFE_URL_RE.test(value.replace(URL_IGNORED_RE, "")); }
+        function sanitizeHtml(h) {
+            var doc = new DOMParser().parseFromString(h, "text/html"), tmp = doc.body;
+            var w = doc.createTreeWalker(tmp, NodeFilter.SHOW_ELEMENT), toRemove = [];
+            while (w.nextNode()) { var c = w.currentNode; if (!SAFE_TAGS.has(c.tagName.toLowerCase())) { toRemove.push(c); continue; } var attrs = c.attributes; for (var j = attrs.length - 1; j >= 0; j--) { var a = attrs[j], n = a.name.toLowerCase(); if (!SAFE_ATTRS.has(n) || (URL_ATTR_RE.test(n) && isUnsafeUrl(a.value))) { c.removeAttribute(a.name); } } }
+            for (var k = 0; k < toRemove.length; k++) toRemove[k].remove();
+            return tmp.innerHTML;
+        }
+        var MATH_STASH_RE = /\\$\\$[\\s\\S]*?\\$\\$|\\\\\\[[\\s\\S]*?\\\\\\]|\\\\begin\\{([^}]+)\\}[\\s\\S]*?\\\\end\\{\\1\\}|\\\\\\(.*?\\\\\\)|(?<![\\\\$])\\$(?!\\$)[^$\\n]+\\$(?!\\$)/g;
+        var mdCache = new Map();
+        function renderMathBlock(block, target) {
+            var displayMode, body;
+            if (block.startsWith("$$")) { displayMode = true; body = block.slice(2, -2); }
+            else if (block.startsWith("\\\\[")) { displayMode = true; body = block.slice(2, -2); }
+            else if (block.startsWith("\\\\(")) { displayMode = false; body = block.slice(2, -2); }
+            else if (block.startsWith("$")) { displayMode = false; body = block.slice(1, -1); }
+            if (typeof katex !== "undefined" && body !== undefined) {
+                try { katex.render(body, target, { displayMode: displayMode, throwOnError: false }); return; } catch (e) {}
+            }
+            target.textContent = block;
+        }
+        function renderMarkdown(content) {
+            var hit = mdCache.get(content); if (hit !== undefined) return hit.content.cloneNode(true);
+            var mathBlocks = [];
+            var safe = content.replace(MATH_STASH_RE, function(match, env) { var id = "\\x00MATH" + mathBlocks.length + "\\x00"; mathBlocks.push(env ? "$$" + match + "$$" : match); return id; });
+            var html = marked.parse(safe);
+            var tpl = document.createElement("template");
+            if (mathBlocks.length) {
+                tpl.innerHTML = html.replace(/\\x00MATH(\\d+)\\x00/g, "<span data-math-id=\\"$1\\"></span>");
+                tpl.content.querySelectorAll("span[data-math-id]").forEach(function(ph) { var block = mathBlocks[+ph.dataset.mathId]; if (block === undefined) return; renderMathBlock(block, ph); ph.replaceWith(ph.firstChild); });
+            } else {
+                tpl.innerHTML = html;
+            }
+            if (!mathBlocks.length || typeof katex !== "undefined") { if (mdCache.size >= 256) mdCache.clear(); mdCache.set(content, tpl); }
+            return tpl.content.cloneNode(true);
+        }
+        const outputLabel = document.createElement("span");
+        outputLabel.className = "output-label";
+        outputLabel.textContent = "Output:";
+        function buildOutputNodes(cell) {
+            var frag = document.createDocumentFragment(), el;
+            var label = frag.appendChild(outputLabel.cloneNode(true));
+            function add(node) { if (frag.lastChild !== label) frag.appendChild(document.createTextNode("\\n")); frag.appendChild(node); }
+            if (cell.output) { add(document.createTextNode(cell.output)); }
+            if (cell.outputHtml) { el = document.createElement("div"); el.className = "html-output"; el.innerHTML = sanitizeHtml(cell.outputHtml); add(el); }
+            if (cell.images && cell.images.length) {
+                for (var i = 0; i < cell.images.length; i++) { add(outputImages[cell.images[i]].content.firstChild.cloneNode()); }
+            }
+            if (cell.error) { el = document.createElement("div"); el.className = "error-output"; el.textContent = cell.error; add(el); }
+            return frag;
+        }
+        function hasOutput(cell) {
+            if (cell._hasOutput === undefined) cell._hasOutput = !!(cell.output || cell.outputHtml || (cell.images && cell.images.length) || cell.error);
+            return cell._hasOutput;
+        }
+        const mdCellTpl = document.getElementById("md-cell-tpl").content.firstElementChild;
+        const codeCellTpl = document.getElementById("code-cell-tpl").content.firstElementChild;
+        function renderCell(cell, index) {
+            var cellDiv;
+            if (cell.type === "markdown") {
+                cellDiv = mdCellTpl.cloneNode(true);
+                cellDiv.querySelector(".markdown-content").appendChild(renderMarkdown(cell.content));
+            } else {
+                cellDiv = codeCellTpl.cloneNode(true);
+                cellDiv.querySelector(".cell-number").textContent = cell.executionCount != null ? "In [" + cell.executionCount + "]:" : "In [\\u00a0]:";
+                var runButton = cellDiv.querySelector(".run-button");
+                runButton.setAttribute("aria-label", "Run cell " + (index + 1));
+                runButton.onclick = function() { executeCell(index); };
+                var code = cellDiv.querySelector("code");
+                code.className = "language-" + PRISM_LANG;
+                code.textContent = cell.content;
+                var outputDiv = cellDiv.querySelector(".output-area");
+                outputDiv.id = "output-" + index;
+                outputAreas[index] = outputDiv;
+                if (hasOutput(cell)) {
+                    outputDiv.classList.remove("hidden");
+                    outputDiv.appendChild(buildOutputNodes(cell));
+                }
+            }
+            cellDiv.id = "cell-" + index;
+            cellDiv.setAttribute("aria-label", cell.type + " cell " + (index + 1));
+            return cellDiv;
+        }
+        const loadingNode = document.createElement("div");
+        loadingNode.className = "loading";
+        loadingNode.innerHTML = "<div class=\\"loading-spinner\\"></div><span>Executing cell...</span>";
+        const runStatus = document.getElementById("run-status");
+        const SIMULATE_DELAY = false;
+        function scheduleRun(fn) {
+            if (SIMULATE_DELAY) return setTimeout(fn, Math.random() * 800 + 400);
+            if (document.hidden) return setTimeout(fn, 0);
+            var done = false;
+            function run() { if (!done) { done = true; fn(); } }
+            requestAnimationFrame(function() { setTimeout(run, 0); });
+            setTimeout(run, 100);
+        }
+        function executeCell(index) {
+            if (isExecuting) return;
+            var cell = notebookCells[index];
+            if (!cell || cell.type !== "code") return;
+            isExecuting = true;
+            runStatus.textContent = "";
+            if (placeholders[index]) mountCell(index);
+            var outputDiv = outputAreas[index];
+            outputDiv.classList.remove("hidden");
+            outputDiv.classList.add("executing");
+            outputDiv.appendChild(loadingNode);
+            scheduleRun(function() {
+                loadingNode.remove();
+                outputDiv.classList.remove("executing");
+                if (!outputDiv.firstChild) {
+                    if (hasOutput(cell)) {
+                        outputDiv.appendChild(buildOutputNodes(cell));
+                        var latex = outputDiv.getElementsByClassName("latex-output");
+                        if (latex.length && typeof renderMathInElement !== "undefined") {
+                            for (var k = 0; k < latex.length; k++) { if (hasMathDelimiters(latex[k].textContent)) renderMathInElement(latex[k], {delimiters: KATEX_DELIMS}); }
+                        }
+                    } else {
+                        outputDiv.innerHTML = "<span style=\\"color: var(--text-secondary);\\">Cell executed successfully (no output)</span>";
+                    }
+                }
+                isExecuting = false;
+                if (window.runningAll) { advanceRunAll(); } else { runStatus.textContent = "Cell " + (index + 1) + " of " + notebookCells.length + " executed"; }
+            });
+        }
+        function runAllCells() {
+            if (isExecuting) return;
+            window.runningAll = true;
+            currentCell = 0;
+            while (currentCell < notebookCells.length && notebookCells[currentCell].type !== "code") { currentCell++; }
+            if (currentCell < notebookCells.length) { executeCell(currentCell); } else { window.runningAll = false; }
         }
+        var scheduleIdle = window.requestIdleCallback
+            ? function(fn) { window.requestIdleCallback(fn, { timeout: 50 }); }
+            : function(fn) { setTimeout(function() { var end = Date.now() + 8; fn({ timeRemaining: function() { return Math.max(0, end - Date.now()); } }); }, 0); };
+        function advanceRunAll() {
+            currentCell++;
+            while (currentCell < notebookCells.length && notebookCells[currentCell].type !== "code") { currentCell++; }
+            if (currentCell < notebookCells.length) { scheduleIdle(function() { executeCell(currentCell); }); } else { window.runningAll = false; runStatus.textContent = "All cells executed"; }
+        }
+        function clearOutputs() {
+            window.runningAll = false;
+            outputsCleared = true;
+            outputAreas.forEach(function(el) { el.classList.add("hidden"); });
+            runStatus.textContent = "All outputs cleared";
+        }
+        function resetNotebook() {
+            window.runningAll = false;
+            isExecuting = false;
+            currentCell = 0;
+            initNotebook();
+        }
+        function highlightWhenIdle(nodes) {
+            var i = 0;
+            scheduleIdle(function step(deadline) {
+                do { var el = nodes[i++]; if (!el.isConnected) return; if (/\\S/.test(el.textContent)) Prism.highlightElement(el, false); } while (i < nodes.length && deadline.timeRemaining() > 1);
+                if (i < nodes.length) scheduleIdle(step);
+            });
+        }
+        const EAGER_CELLS = 100;
+        function estimateCellHeight(cell) {
+            var lines = 1;
+            for (var i = cell.content.indexOf("\\n"); i !== -1; i = cell.content.indexOf("\\n", i + 1)) lines++;
+            return 40 + lines * 22 + (hasOutput(cell) ? 120 : 0);
+        }
+        function createPlaceholder(cell, index) {
+            var ph = document.createElement("div");
+            ph.className = "cell-placeholder";
+            ph.dataset.idx = index;
+            ph.style.height = estimateCellHeight(cell) + "px";
+            placeholders[index] = ph;
+            return ph;
+        }
+        function mountCell(index, sync) {
+            var ph = placeholders[index];
+            delete placeholders[index];
+            cellObserver.unobserve(ph);
+            var cellDiv = renderCell(notebookCells[index], index);
+            if (outputsCleared && outputAreas[index]) outputAreas[index].classList.add("hidden");
+            ph.replaceWith(cellDiv);
+            decorateCells(cellDiv, sync);
+        }
+        function mountWhenIdle() {
+            var pending = placeholders;
+            var i = EAGER_CELLS;
+            scheduleIdle(function step(deadline) {
+                if (pending !== placeholders) return;
+                while (i < pending.length && deadline.timeRemaining() > 1) { if (pending[i]) mountCell(i); i++; }
+                if (i < pending.length) scheduleIdle(step);
+            });
+        }
+        window.addEventListener("beforeprint", function() { placeholders.forEach(function(ph, index) { mountCell(index, true); }); });
+        function initNotebook() {
+            var container = document.getElementById("notebook");
+            if (cellObserver) cellObserver.disconnect();
+            outputAreas = [];
+            placeholders = [];
+            outputsCleared = false;
+            var lazy = notebookCells.length > EAGER_CELLS && "IntersectionObserver" in window;
+            cellObserver = lazy ? new IntersectionObserver(function(entries) {
+                entries.forEach(function(e) { if (e.isIntersecting && placeholders[e.target.dataset.idx] === e.target) mountCell(+e.target.dataset.idx); });
+            }, { rootMargin: "1000px 0px" }) : null;
+            var frag = document.createDocumentFragment();
+            notebookCells.forEach(function(cell, index) { frag.appendChild(lazy && index >= EAGER_CELLS ? createPlaceholder(cell, index) : renderCell(cell, index)); });
+            container.replaceChildren(frag);
+            placeholders.forEach(function(ph) { cellObserver.observe(ph); });
+            decorateCells(container);
+            if (lazy) mountWhenIdle();
+        }
+        function decorateCells(root, sync) {
+            if (sync) { highlightCells(root, true); typesetCells(root); return; }
+            requestAnimationFrame(function() {
+                highlightCells(root, false);
+                requestAnimationFrame(function() { typesetCells(root); });
+            });
+        }
+        function highlightCells(root, sync) {
+            var codeBlocks = root.querySelectorAll("pre > code[class*=\\"language-\\"]");
+            if (typeof Prism === "undefined" || !codeBlocks.length) return;
+            if (!sync) return highlightWhenIdle(codeBlocks);
+            codeBlocks.forEach(function(el) { if (/\\S/.test(el.textContent)) Prism.highlightElement(el, false); });
+        }
+        function typesetCells(root) {
+            if (typeof renderMathInElement === "undefined") return;
+            var pending = Array.prototype.filter.call(root.getElementsByClassName("latex-output"), function(el) { return hasMathDelimiters(el.textContent); });
+            pending.forEach(function(el) { renderMathInElement(el, {delimiters: KATEX_DELIMS}); });
+        }
+        document.addEventListener("keydown", function(e) {
+            if (e.ctrlKey && e.key === "Enter") {
+                var focusedCell = document.activeElement.closest(".cell");
+                if (focusedCell) { var cellId = parseInt(focusedCell.id.replace("cell-", "")); executeCell(cellId); }
+            }
+        });
+        document.addEventListener("DOMContentLoaded", function() { initNotebook(); });
+    <\/script>
+</body>
+</html>`;
 
         // =====================================================================
         // Conversion logic (ported from jupyderp.py)
@@ -1912,40 +2475,107 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
             return lines || '';
         }
 
-        function escapeHtmlStr(text) {
-            var div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
+        // KaTeX assets, spliced into the template head only for notebooks
+        // that contain math (mirrors _KATEX_HEAD in jupyderp.py)
+        var KATEX_HEAD = [
+            '',
+            '    <!-- KaTeX for math -->',
+            '    <link rel="preload" as="style" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css" onload="this.onload=null;this.rel=\'stylesheet\'">',
+            '    <noscript><link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.css"></noscript>',
+            '    <link rel="preload" as="font" type="font/woff2" crossorigin href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/fonts/KaTeX_Main-Regular.woff2">',
+            '    <link rel="preload" as="font" type="font/woff2" crossorigin href="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/fonts/KaTeX_Math-Italic.woff2">',
+            '    <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/katex.min.js"></' + 'script>',
+            '    <script defer src="https://cdn.jsdelivr.net/npm/katex@0.16.8/dist/contrib/auto-render.min.js"></' + 'script>',
+            ''
+        ].join('\n');
+        var MATH_RE = /\$|\\[(\[]|\\begin\{/;
+
+        function notebookHasMath(nb) {
+            var cells = nb.cells || [];
+            for (var i = 0; i < cells.length; i++) {
+                var cellType = cells[i].cell_type || 'code';
+                if (cellType === 'markdown' || cellType === 'raw') {
+                    if (MATH_RE.test(joinField(cells[i].source))) return true;
+                    continue;
+                }
+                var outputs = cells[i].outputs || [];
+                for (var j = 0; j < outputs.length; j++) {
+                    var latex = (outputs[j].data || {})['text/latex'];
+                    if (latex && MATH_RE.test(joinField(latex))) return true;
+                }
+            }
+            return false;
         }
 
-        var SAFE_TAGS_RE = /^(?:a|abbr|b|blockquote|br|caption|code|col|colgroup|dd|del|details|dfn|div|dl|dt|em|figcaption|figure|h[1-6]|hr|i|img|ins|kbd|li|mark|ol|p|pre|q|rp|rt|ruby|s|samp|small|span|strong|sub|summary|sup|svg|table|tbody|td|tfoot|th|thead|tr|u|ul|var|wbr|circle|clippath|defs|ellipse|g|line|linearGradient|marker|mask|path|pattern|polygon|polyline|radialGradient|rect|stop|text|tspan)$/i;
-        var SAFE_ATTRS_RE = /^(?:alt|border|cellpadding|cellspacing|class|colspan|dir|height|href|id|lang|name|role|rowspan|scope|src|style|summary|tabindex|title|valign|width|cx|cy|d|dx|dy|fill|fill-opacity|fill-rule|font-family|font-size|font-weight|gradientTransform|gradientUnits|markerHeight|markerWidth|offset|opacity|orient|patternUnits|points|preserveAspectRatio|r|refX|refY|rx|ry|stop-color|stop-opacity|stroke|stroke-dasharray|stroke-linecap|stroke-linejoin|stroke-opacity|stroke-width|text-anchor|transform|viewBox|x|x1|x2|xmlns|y|y1|y2)$/i;
+        // The characters (and entities) the DOM uses when serializing a
+        // text node, so output matches the old textContent/innerHTML trick
+        var HTML_SPECIAL_RE = /[&<>\u00a0]/;
+        var HTML_SPECIAL_RE_G = /[&<>\u00a0]/g;
+        var HTML_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '\u00a0': '&nbsp;'};
+        function escapeHtmlChar(c) { return HTML_ESCAPES[c]; }
+
+        function escapeHtmlStr(text) {
+            // Most LaTeX sources and titles need no escaping at all
+            if (!HTML_SPECIAL_RE.test(text)) return text;
+            return text.replace(HTML_SPECIAL_RE_G, escapeHtmlChar);
+        }
+
+        var URL_ATTR_RE = /^(?:href|src|action)$/;
+        // Browsers skip leading C0 controls and spaces and drop tab, CR and
+        // LF anywhere in a URL before reading its scheme, so "java\tscript:"
+        // is checked as "javascript:" (as in _DANGEROUS_URL_SCHEMES)
+        var UNSAFE_URL_RE = /^[\x00-\x20]*(?:javascript|vbscript|data)\s*:/i;
+        var URL_IGNORED_RE = /[\t\n\r]/g;
+        // Most URLs (http:, relative, #anchor) are ruled out by their first
+        // character alone: controls, space, j, v and d are risky, and
+        // non-ASCII leads still go through the regex
+        var URL_RISKY_FIRST = new Uint8Array(128);
+        URL_RISKY_FIRST.fill(1, 0, 33);
+        [68, 74, 86, 100, 106, 118].forEach(function(c) { URL_RISKY_FIRST[c] = 1; });
+        function isUnsafeUrl(value) {
+            var c = value.charCodeAt(0);
+            return (c >= 128 || URL_RISKY_FIRST[c] === 1) &&
+                UNSAFE_URL_RE.test(value.replace(URL_IGNORED_RE, ''));
+        }
+        // Lowercase names; tagName is lowercased for lookup because SVG
+        // elements such as linearGradient keep their case
+        var SAFE_TAGS = new Set('a abbr b blockquote br caption code col colgroup dd del details dfn div dl dt em figcaption figure h1 h2 h3 h4 h5 h6 hr i img ins kbd li mark ol p pre q rp rt ruby s samp small span strong sub summary sup svg table tbody td tfoot th thead tr u ul var wbr circle clippath defs ellipse g line lineargradient marker mask path pattern polygon polyline radialgradient rect stop text tspan'.split(' '));
+        var SAFE_ATTRS = new Set('alt border cellpadding cellspacing class colspan dir height href id lang name role rowspan scope src style summary tabindex title valign width cx cy d dx dy fill fill-opacity fill-rule font-family font-size font-weight gradienttransform gradientunits markerheight markerwidth offset opacity orient patternunits points preserveaspectratio r refx refy rx ry stop-color stop-opacity stroke stroke-dasharray stroke-linecap stroke-linejoin stroke-opacity stroke-width text-anchor transform viewbox x x1 x2 xmlns y y1 y2'.split(' '));
+        // Keyed by the raw HTML itself, like the Python side's lru_cache:
+        // banner and widget outputs often repeat across cells and reconversions.
+        // Outputs above SANITIZE_CACHE_MAX_CHARS (plotly figures run to
+        // megabytes) are not kept, so the cache can't pin them in the tab.
+        var sanitizeCache = new Map();
+        var SANITIZE_CACHE_MAX_CHARS = 64 * 1024;
+
         function sanitizeHtml(html) {
-            var tmp = document.createElement('div');
-            tmp.innerHTML = html;
-            function walk(node) {
-                var ch = Array.from(node.childNodes);
-                for (var i = 0; i < ch.length; i++) {
-                    var c = ch[i];
-                    if (c.nodeType === 1) {
-                        if (!SAFE_TAGS_RE.test(c.tagName)) { c.remove(); continue; }
-                        var attrs = Array.from(c.attributes);
-                        for (var j = 0; j < attrs.length; j++) {
-                            var n = attrs[j].name.toLowerCase();
-                            if (n.startsWith('on') || !SAFE_ATTRS_RE.test(n)) {
-                                c.removeAttribute(attrs[j].name);
-                            } else if (n === 'href' || n === 'src' || n === 'action') {
-                                if (/^\s*(?:javascript|vbscript|data)\s*:/i.test(attrs[j].value)) {
-                                    c.removeAttribute(attrs[j].name);
-                                }
-                            }
-                        }
-                        walk(c);
+            var cacheable = html.length <= SANITIZE_CACHE_MAX_CHARS;
+            var hit = cacheable ? sanitizeCache.get(html) : undefined;
+            if (hit !== undefined) return hit;
+            var doc = new DOMParser().parseFromString(html, 'text/html');
+            var tmp = doc.body;
+            var w = doc.createTreeWalker(tmp, NodeFilter.SHOW_ELEMENT);
+            var toRemove = [];
+            while (w.nextNode()) {
+                var c = w.currentNode;
+                if (!SAFE_TAGS.has(c.tagName.toLowerCase())) { toRemove.push(c); continue; }
+                var attrs = c.attributes;
+                for (var j = attrs.length - 1; j >= 0; j--) {
+                    var a = attrs[j];
+                    var n = a.name.toLowerCase();
+                    if (!SAFE_ATTRS.has(n) ||
+                            (URL_ATTR_RE.test(n) && isUnsafeUrl(a.value))) {
+                        c.removeAttribute(a.name);
                     }
                 }
             }
-            walk(tmp);
-            return tmp.innerHTML;
+            for (var k = 0; k < toRemove.length; k++) toRemove[k].remove();
+            var clean = tmp.innerHTML;
+            if (cacheable) {
+                if (sanitizeCache.size >= 128) sanitizeCache.clear();
+                sanitizeCache.set(html, clean);
+            }
+            return clean;
         }
 
         function stripAnsi(str) {
@@ -1979,6 +2609,16 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
             return fallback;
         }
 
+        // The payload ends up in an HTML attribute, so anything outside the
+        // base64 alphabet is refused rather than escaped (as in _collect_b64)
+        var B64_INVALID_RE = /[^A-Za-z0-9+\/=\s]/;
+
+        function collectB64(value) {
+            if (Array.isArray(value)) value = value.join('');
+            if (B64_INVALID_RE.test(value)) throw new Error('invalid character in base64 image data');
+            return value.replace(/\s+/g, '');
+        }
+
         function extractCellData(cell) {
             var cellType = cell.cell_type || 'code';
             var source = joinField(cell.source);
@@ -2007,21 +2647,15 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
                     var data = out.data || {};
                     var hasRich = false;
                     if (data['image/png']) {
-                        var imgData = data['image/png'];
-                        if (Array.isArray(imgData)) imgData = imgData.join('');
-                        imageParts.push({data: imgData.trim(), mime: 'image/png'});
+                        imageParts.push({data: collectB64(data['image/png']), mime: 'image/png'});
                         hasRich = true;
                     }
                     if (data['image/jpeg']) {
-                        var jpgData = data['image/jpeg'];
-                        if (Array.isArray(jpgData)) jpgData = jpgData.join('');
-                        imageParts.push({data: jpgData.trim(), mime: 'image/jpeg'});
+                        imageParts.push({data: collectB64(data['image/jpeg']), mime: 'image/jpeg'});
                         hasRich = true;
                     }
                     if (data['image/gif']) {
-                        var gifData = data['image/gif'];
-                        if (Array.isArray(gifData)) gifData = gifData.join('');
-                        imageParts.push({data: gifData.trim(), mime: 'image/gif'});
+                        imageParts.push({data: collectB64(data['image/gif']), mime: 'image/gif'});
                         hasRich = true;
                     }
                     if (data['image/svg+xml']) {
@@ -2079,33 +2713,65 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
             return result;
         }
 
-        function notebookToJsCells(nb) {
+        // Template text at even indices, placeholder names at odd ones
+        var TEMPLATE_PARTS = NOTEBOOK_TEMPLATE.split(/\{\{(TITLE|PRISM_LANG|KATEX_HEAD|IMAGES|CELLS_JSON)\}\}/);
+
+        // Extracts the cells into kept, pushing an image <template> per
+        // output image and replacing each cell's images by their indices
+        function pushImageTemplates(parts, nb, kept) {
             var cells = nb.cells || [];
-            var jsCells = [];
+            var n = 0;
             for (var i = 0; i < cells.length; i++) {
                 var data = extractCellData(cells[i]);
                 if (data.type === 'code' && !(data.content || '').trim()) continue;
-                jsCells.push(data);
+                if (data.images) {
+                    var refs = [];
+                    for (var j = 0; j < data.images.length; j++) {
+                        var img = data.images[j];
+                        parts.push('<template class="output-image"><img src="data:' + img.mime +
+                            ';base64,' + img.data + '" alt="Cell output image"></template>');
+                        refs.push(n++);
+                    }
+                    data.images = refs;
+                }
+                kept.push(data);
             }
-            return jsCells;
         }
 
-        function buildHtml(nb, customTitle) {
+        function pushCellsJson(parts, kept) {
+            var sep = '';
+            parts.push('[');
+            for (var i = 0; i < kept.length; i++) {
+                // Escape "</" so that closing-tag sequences inside cell data
+                // don't prematurely terminate the script block in generated HTML.
+                parts.push(sep + JSON.stringify(kept[i]).replace(/<\//g, '<\\/'));
+                sep = ',';
+            }
+            parts.push(']');
+        }
+
+        // Returns the page as a list of strings for the Blob constructor:
+        // images and cells are emitted one at a time, so neither the cells
+        // JSON nor the full page ever exists as one string.
+        function buildHtmlParts(nb, customTitle) {
             var language = detectKernelLanguage(nb);
             var prismLang = SUPPORTED_LANGS.indexOf(language) !== -1 ? language : 'python';
             var title = customTitle || detectTitle(nb, 'Jupyter Notebook');
-            var cellsJson = JSON.stringify(notebookToJsCells(nb));
-            // Escape "</" so that closing-tag sequences inside cell data
-            // don't prematurely terminate the script block in generated HTML.
-            cellsJson = cellsJson.replace(/<\//g, '<\\/');
-
-            var template = getNotebookTemplate();
-            // Use function replacements to avoid JS treating $ in
-            // cellsJson as special replacement patterns ($&, $$, etc.)
-            return template
-                .replace(/\{\{TITLE\}\}/g, function() { return escapeHtmlStr(title); })
-                .replace(/\{\{PRISM_LANG\}\}/g, function() { return prismLang; })
-                .replace(/\{\{CELLS_JSON\}\}/g, function() { return cellsJson; });
+            var values = {
+                TITLE: escapeHtmlStr(title),
+                PRISM_LANG: prismLang,
+                KATEX_HEAD: notebookHasMath(nb) ? KATEX_HEAD : ''
+            };
+            var parts = [];
+            var kept = [];
+            for (var i = 0; i < TEMPLATE_PARTS.length; i++) {
+                var part = TEMPLATE_PARTS[i];
+                if (!(i % 2)) parts.push(part);
+                else if (part === 'IMAGES') pushImageTemplates(parts, nb, kept);
+                else if (part === 'CELLS_JSON') pushCellsJson(parts, kept);
+                else parts.push(values[part]);
+            }
+            return parts;
         }
 
         // =====================================================================
@@ -2121,7 +2787,8 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
         var resultActions = document.getElementById('result-actions');
         var previewFrame = document.getElementById('preview-frame');
 
-        var convertedHtml = null;
+        var convertedBlob = null;
+        var previewUrl = null;
         var convertedFileName = 'notebook.html';
         var selectedFile = null;
 
@@ -2164,7 +2831,8 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
             selectedFile = file;
             fileNameEl.textContent = 'Selected: ' + file.name;
             convertBtn.disabled = false;
-            convertedHtml = null;
+            convertedBlob = null;
+            if (previewUrl) { URL.revokeObjectURL(previewUrl); previewUrl = null; }
             resultActions.classList.remove('visible');
             previewFrame.classList.remove('visible');
             statusEl.classList.remove('visible');
@@ -2184,7 +2852,7 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
                 try {
                     var nb = JSON.parse(ev.target.result);
                     var title = document.getElementById('custom-title').value.trim() || null;
-                    convertedHtml = buildHtml(nb, title);
+                    convertedBlob = new Blob(buildHtmlParts(nb, title), { type: 'text/html' });
                     showStatus('Conversion successful!', 'success');
                     resultActions.classList.add('visible');
                 } catch (err) {
@@ -2201,9 +2869,8 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
 
         // --- Result actions ---
         document.getElementById('download-btn').addEventListener('click', function() {
-            if (!convertedHtml) return;
-            var blob = new Blob([convertedHtml], { type: 'text/html' });
-            var url = URL.createObjectURL(blob);
+            if (!convertedBlob) return;
+            var url = URL.createObjectURL(convertedBlob);
             var a = document.createElement('a');
             a.href = url;
             a.download = convertedFileName;
@@ -2212,17 +2879,18 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
         });
 
         document.getElementById('preview-btn').addEventListener('click', function() {
-            if (!convertedHtml) return;
+            if (!convertedBlob) return;
             previewFrame.classList.toggle('visible');
             if (previewFrame.classList.contains('visible')) {
-                previewFrame.srcdoc = convertedHtml;
+                if (previewUrl) URL.revokeObjectURL(previewUrl);
+                previewUrl = URL.createObjectURL(convertedBlob);
+                previewFrame.src = previewUrl;
             }
         });
 
         document.getElementById('new-tab-btn').addEventListener('click', function() {
-            if (!convertedHtml) return;
-            var blob = new Blob([convertedHtml], { type: 'text/html' });
-            var url = URL.createObjectURL(blob);
+            if (!convertedBlob) return;
+            var url = URL.createObjectURL(convertedBlob);
             window.open(url, '_blank');
             setTimeout(function() { URL.revokeObjectURL(url); }, 60000);
         });
@@ -2235,65 +2903,202 @@ _UPLOAD_PAGE = r"""<!DOCTYPE html>
 </body>
 </html>
 """
+_UPLOAD_PAGE = _UPLOAD_PAGE.replace("{{NOTEBOOK_CSS}}", json.dumps(_NOTEBOOK_CSS))
 
 
 # ---------------------------------------------------------------------------
 # Web server
 # ---------------------------------------------------------------------------
+# Static response bodies, encoded once at import
+_UPLOAD_PAGE_BYTES = _UPLOAD_PAGE.encode("utf-8")
+_NOT_FOUND_BYTES = b"<h1>Not Found</h1>"
+# (headers after Date, body) of the GET / response per Content-Encoding,
+# filled on first request
+_UPLOAD_RESPONSES: dict[str | None, tuple[bytes, bytes]] = {}
+# Compiled once; both run on every /convert request.  The boundary may be
+# quoted or unquoted.
+_BOUNDARY_RE = _re.compile(r'boundary=(?:"([^"]+)"|([^\s;]+))')
+_NAME_RE = _re.compile(r'name="([^"]+)"')
+
+
 def _extract_boundary(content_type: str) -> bytes | None:
     """Extract the multipart boundary from a Content-Type header."""
-    # Handle both quoted and unquoted boundary values
-    m = _re.search(r'boundary="([^"]+)"', content_type) or \
-        _re.search(r'boundary=([^\s;]+)', content_type)
+    m = _BOUNDARY_RE.search(content_type)
     if m:
-        return m.group(1).encode("ascii")
+        return (m.group(1) or m.group(2)).encode("ascii")
     return None
 
 
-def _parse_multipart(body: bytes, boundary: bytes) -> dict[str, bytes]:
-    """Minimal multipart/form-data parser (stdlib only, no cgi)."""
-    parts: dict[str, bytes] = {}
+def _parse_multipart(body: bytes, boundary: bytes) -> dict[str, memoryview]:
+    """Minimal multipart/form-data parser (stdlib only, no cgi).
+
+    Field values are memoryview slices of *body*, so a large upload is
+    never copied while locating its parts.
+    """
+    parts: dict[str, memoryview] = {}
+    view = memoryview(body)
     delimiter = b"--" + boundary
-    segments = body.split(delimiter)
-    for seg in segments:
-        # Skip preamble and epilogue
-        if seg in (b"", b"--", b"--\r\n", b"\r\n"):
-            continue
-        seg = seg.lstrip(b"\r\n")
-        if seg.startswith(b"--"):
-            continue
+    pos = body.find(delimiter)
+    while pos != -1:
+        start = pos + len(delimiter)
+        # "--" right after the delimiter marks the closing boundary
+        if body.startswith(b"--", start):
+            break
+        pos = body.find(delimiter, start)
+        end = len(body) if pos == -1 else pos
+        while start < end and body[start] in b"\r\n":
+            start += 1
         # Split headers from body
-        sep = seg.find(b"\r\n\r\n")
+        sep = body.find(b"\r\n\r\n", start, end)
         if sep == -1:
             continue
-        header_block = seg[:sep].decode("utf-8", errors="replace")
-        payload = seg[sep + 4:]
+        header_block = body[start:sep].decode("utf-8", errors="replace")
         # Strip trailing \r\n
-        if payload.endswith(b"\r\n"):
-            payload = payload[:-2]
+        if end - 2 >= sep + 4 and body.startswith(b"\r\n", end - 2):
+            end -= 2
         # Find field name
-        m = _re.search(r'name="([^"]+)"', header_block)
+        m = _NAME_RE.search(header_block)
         if m:
-            parts[m.group(1)] = payload
+            parts[m.group(1)] = view[sep + 4:end]
     return parts
 
 
+def _pick_encoding(accept: str) -> str | None:
+    """Choose a Content-Encoding from an Accept-Encoding header."""
+    offered = set()
+    for item in accept.lower().split(","):
+        coding, _, params = item.partition(";")
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                if float(params[2:]) == 0:
+                    continue  # explicitly refused
+            except ValueError:
+                continue
+        offered.add(coding.strip())
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    """Compress a whole response body with *encoding*."""
+    if encoding == "br":
+        return brotli.compress(data, quality=4)
+    feed, finish = _compressor(encoding)
+    return feed(data) + finish()
+
+
+def _compressor(encoding: str):
+    """Return (feed, finish) callables compressing a body incrementally."""
+    if encoding == "br":
+        c = brotli.Compressor(quality=4)
+        return c.process, c.finish
+    c = zlib.compressobj(5, zlib.DEFLATED, 31)  # wbits=31: gzip container
+    return c.compress, c.flush
+
+
+def _upload_response(encoding: str | None) -> tuple[bytes, bytes]:
+    """Return the precomputed header tail and body of the upload page."""
+    response = _UPLOAD_RESPONSES.get(encoding)
+    if response is None:
+        body = _UPLOAD_PAGE_BYTES
+        head = b"Content-Type: text/html; charset=utf-8\r\n"
+        if encoding is not None:
+            body = _compress(body, encoding)
+            head += b"Content-Encoding: %s\r\nVary: Accept-Encoding\r\n" % encoding.encode("ascii")
+        head += b"Content-Length: %d\r\n\r\n" % len(body)
+        response = _UPLOAD_RESPONSES[encoding] = (head, body)
+    return response
+
+
+# Rendered pages keyed by (SHA-256 of the uploaded notebook, title,
+# Content-Encoding), stored exactly as sent so a hit is compressed only once
+# and re-uploading an unchanged notebook skips parsing and conversion.
+_RENDER_CACHE: "OrderedDict[tuple[bytes, str | None, str | None], bytes | io.BufferedRandom]" = OrderedDict()
+_RENDER_CACHE_SIZE = 32
+# Image-heavy pages run to tens of MB, so the entry count alone does not
+# bound memory; evict until the pages also fit in this many bytes
+_RENDER_CACHE_MAX_BYTES = 64 << 20
+_render_cache_bytes = 0
+# Cached pages at least this large are moved into an anonymous memory file
+# and sent with os.sendfile, skipping the copy through Python on each hit
+_SENDFILE_MIN_BYTES = 256 << 10
+_CAN_SENDFILE = hasattr(os, "sendfile") and hasattr(os, "memfd_create")
+# Handler threads share the cache; OrderedDict reordering is not atomic
+_RENDER_CACHE_LOCK = threading.Lock()
+
+
+def _page_size(page: bytes | io.BufferedRandom) -> int:
+    """Byte size of a cached page held in memory or in a memory file."""
+    if isinstance(page, bytes):
+        return len(page)
+    return os.fstat(page.fileno()).st_size
+
+
+def _cache_get(key: tuple[bytes, str | None, str | None]) -> bytes | io.BufferedRandom | None:
+    """Return a cached rendered page, marking it most recently used."""
+    with _RENDER_CACHE_LOCK:
+        cached = _RENDER_CACHE.get(key)
+        if cached is not None:
+            _RENDER_CACHE.move_to_end(key)
+        return cached
+
+
+def _cache_put(key: tuple[bytes, str | None, str | None], page: bytes) -> None:
+    """Store a rendered page, evicting least recently used entries."""
+    global _render_cache_bytes
+    size = len(page)
+    if size > _RENDER_CACHE_MAX_BYTES:
+        return
+    entry = page
+    if _CAN_SENDFILE and size >= _SENDFILE_MIN_BYTES:
+        entry = open(os.memfd_create("jupyderp-page"), "w+b")
+        entry.write(page)
+        entry.flush()
+    with _RENDER_CACHE_LOCK:
+        # Evicted memory files are closed once the last handler sending
+        # them drops its reference
+        old = _RENDER_CACHE.pop(key, None)
+        if old is not None:
+            _render_cache_bytes -= _page_size(old)
+        _RENDER_CACHE[key] = entry
+        _render_cache_bytes += size
+        while (len(_RENDER_CACHE) > _RENDER_CACHE_SIZE
+               or _render_cache_bytes > _RENDER_CACHE_MAX_BYTES):
+            _render_cache_bytes -= _page_size(_RENDER_CACHE.popitem(last=False)[1])
+
+
 class JupyderpHandler(BaseHTTPRequestHandler):
     """HTTP request handler for the jupyderp web interface."""
 
     def do_GET(self):
         if self.path == "/" or self.path == "":
-            self._send_html(200, _UPLOAD_PAGE)
-        else:
-            self._send_html(404, "<h1>Not Found</h1>")
+            # Static page: write the status line and precomputed headers
+            # directly instead of going through send_response/send_header
+            head, body = _upload_response(
+                _pick_encoding(self.headers.get("Accept-Encoding", "")))
+            self.log_request(200)
+            self.wfile.write(b"%s 200 OK\r\nServer: %s\r\nDate: %s\r\n%s" % (
+                self.protocol_version.encode("ascii"),
+                self.version_string().encode("ascii"),
+                self.date_time_string().encode("ascii"),
+                head,
+            ))
+            self.wfile.write(body)
+            return
+        self._send_html(404, _NOT_FOUND_BYTES)
 
     def do_POST(self):
         if self.path != "/convert":
-            self._send_html(404, "<h1>Not Found</h1>")
+            self._send_html(404, _NOT_FOUND_BYTES)
             return
 
         content_type = self.headers.get("Content-Type", "")
-        if "multipart/form-data" not in content_type:
+        # Media types are case-insensitive
+        if not content_type.lower().startswith("multipart/form-data"):
             self._send_html(400, "Expected multipart/form-data")
             return
 
@@ -2319,36 +3124,124 @@ class JupyderpHandler(BaseHTTPRequestHandler):
                 self._send_html(400, "No notebook file uploaded")
                 return
 
-            nb = json.loads(parts["notebook"].decode("utf-8"))
-
             # Optional title
             title = None
             if "title" in parts and parts["title"]:
-                title = parts["title"].decode("utf-8").strip() or None
+                title = str(parts["title"], "utf-8").strip() or None
 
-            result_html = build_html(nb, title=title)
-            self._send_html(200, result_html)
+            encoding = _pick_encoding(self.headers.get("Accept-Encoding", ""))
+            key = (hashlib.sha256(parts["notebook"]).digest(), title, encoding)
+            cached = _cache_get(key)
+            if cached is not None:
+                self._send_html(200, cached, encoding, compressed=True)
+                return
+
+            nb = _loads(parts["notebook"])
+            # Extract every cell up front so conversion errors are still
+            # reported with a proper status before any byte is sent
+            values, js_cells = _process_notebook(nb, title)
 
-        except (json.JSONDecodeError, KeyError, UnicodeDecodeError) as exc:
+        except (json.JSONDecodeError, KeyError, UnicodeDecodeError, binascii.Error) as exc:
             self._send_html(400, f"Invalid notebook file: {html.escape(str(exc))}")
+            return
         except Exception as exc:
             self._send_html(500, f"Conversion error: {html.escape(str(exc))}")
+            return
+
+        sent = self._send_html_stream(200, _iter_html_bytes(values, js_cells),
+                                      encoding, _RENDER_CACHE_MAX_BYTES)
+        if sent is not None:
+            _cache_put(key, b"".join(sent))
+
+    def _send_html(self, code, body, encoding=None, compressed=False):
+        """Send *body*, compressed with *encoding* unless already *compressed*.
 
-    def _send_html(self, code, body):
+        *body* may also be a cached page's memory file, sent as is.
+        """
         self.send_response(code)
         self.send_header("Content-Type", "text/html; charset=utf-8")
-        encoded = body.encode("utf-8")
+        if isinstance(body, io.BufferedRandom):
+            self._send_file(body, encoding)
+            return
+        encoded = body if isinstance(body, bytes) else body.encode("utf-8")
+        if encoding is not None:
+            if not compressed:
+                encoded = _compress(encoded, encoding)
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
         self.send_header("Content-Length", str(len(encoded)))
         self.end_headers()
         self.wfile.write(encoded)
 
+    def _send_file(self, f, encoding):
+        """Finish the headers and send memory file *f* with os.sendfile."""
+        size = _page_size(f)
+        if encoding is not None:
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        # Explicit offsets leave the shared file position untouched, so
+        # several handler threads can send the same cached page at once
+        out_fd, in_fd = self.connection.fileno(), f.fileno()
+        offset = 0
+        while offset < size:
+            sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+            if not sent:
+                break
+            offset += sent
+
+    def _send_html_stream(self, code, chunks, encoding=None,
+                          keep_limit=0) -> list[bytes] | None:
+        """Send byte *chunks* as they are produced.
+
+        Returns the bytes sent, for the render cache, if they total at most
+        *keep_limit*; otherwise the kept chunks are dropped as soon as the
+        limit is crossed and None is returned, so a page too large to cache
+        is never held in memory whole.
+
+        No Content-Length is sent: the handler speaks HTTP/1.0, so the end
+        of the body is delimited by closing the connection.
+        """
+        self.send_response(code)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if encoding is not None:
+            feed, finish = _compressor(encoding)
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+
+        def body():
+            for encoded in chunks:
+                if encoding is not None:
+                    encoded = feed(encoded)
+                    if not encoded:
+                        continue
+                yield encoded
+            if encoding is not None:
+                yield finish()
+
+        sent = []
+        size = 0
+        for encoded in body():
+            self.wfile.write(encoded)
+            if sent is not None:
+                size += len(encoded)
+                if size > keep_limit:
+                    sent = None
+                else:
+                    sent.append(encoded)
+        return sent
+
     def log_message(self, fmt, *args):
         print(f"[jupyderp] {fmt % args}" if args else f"[jupyderp] {fmt}")
 
 
 def start_server(port: int = 8000):
     """Launch the jupyderp web interface."""
-    server = HTTPServer(("127.0.0.1", port), JupyderpHandler)
+    # One thread per request: a long conversion no longer blocks the
+    # upload page or other uploads
+    server = ThreadingHTTPServer(("127.0.0.1", port), JupyderpHandler)
     print(f"jupyderp web interface running at http://127.0.0.1:{port}")
     print("Press Ctrl+C to stop.")
     try:
@@ -2378,6 +3271,11 @@ def main():
         "--title",
         help="Custom page title (default: auto-detected from first heading)",
     )
+    parser.add_argument(
+        "--precompress", action="store_true",
+        help="Also write .gz (and .br, if brotli is installed) copies of the "
+             "output for static servers that serve precompressed files",
+    )
     parser.add_argument(
         "--serve", action="store_true",
         help="Launch the web interface instead of converting a file",
@@ -2404,14 +3302,40 @@ def main():
 
     out_path = Path(args.output) if args.output else nb_path.with_suffix(".html")
 
-    nb = read_notebook(str(nb_path))
-    html_content = build_html(nb, title=args.title)
-
-    with open(out_path, "w", encoding="utf-8") as f:
-        f.write(html_content)
+    # Stream into a sibling temp file and rename it over the output only
+    # once the page is complete, so a failed conversion never leaves a
+    # truncated page in place of the previous one
+    tmp_path = out_path.with_name(f".{out_path.name}.{os.getpid()}.tmp")
+    replaced = False
+    try:
+        nb = read_notebook(str(nb_path))
+        with open(tmp_path, "x", encoding="utf-8") as f:
+            write_html(nb, f, title=args.title)
+        # Keep the permissions of the page being replaced
+        if out_path.exists():
+            shutil.copymode(out_path, tmp_path)
+        os.replace(tmp_path, out_path)
+        replaced = True
+    except (json.JSONDecodeError, KeyError, UnicodeDecodeError, binascii.Error) as exc:
+        print(f"Error: invalid notebook file: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except OSError as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as exc:
+        print(f"Error: conversion failed: {exc!r}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        # Also runs on Ctrl-C and on the exits above
+        if not replaced:
+            tmp_path.unlink(missing_ok=True)
 
     print(f"Accessible HTML written to {out_path}")
 
+    if args.precompress:
+        for path in _write_precompressed(out_path):
+            print(f"Precompressed copy written to {path}")
+
 
 if __name__ == "__main__":
     main()